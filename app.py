@@ -1,19 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, Request, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 import shutil
+import hmac
 import os
 import uuid
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Callable, List, Optional
 import httpx
 from datetime import datetime
 import json
 
-from services.fal_service import fal_service
-from config.settings import settings
+from services.backends import get_backend, stream_from_backend
+from services.deadline import (
+    CLIENT_DISCONNECTED, DEADLINE_EXCEEDED, Deadline, GenerationCancelled,
+    current_deadline, iterate_with_deadline
+)
+from services.metrics import metrics
+from services.shared_state import shared_state
+from services.scheduler import QueueTimeout, estimate_cost, scheduler
+from services.tracing import add_span, annotate, bind_trace, span, tracer
+from config.settings import DEFAULT_SECRET_KEY, settings
 
 app = FastAPI(
     title="StoryMaker Dynamic Image Generator", 
@@ -42,6 +54,9 @@ Path("static/mask").mkdir(parents=True, exist_ok=True)
 Path("static/results").mkdir(parents=True, exist_ok=True)
 Path("logs").mkdir(parents=True, exist_ok=True)
 
+# How often an in-flight generation checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
 def log_generation(session_id: str, status: str, details: dict):
     """Log generation details"""
     log_entry = {
@@ -51,13 +66,49 @@ def log_generation(session_id: str, status: str, details: dict):
         "details": details
     }
     
-    log_file = Path("logs") / f"generation_{datetime.now().strftime('%Y%m%d')}.json"
+    day = datetime.now().strftime('%Y%m%d')
+    log_file = Path("logs") / f"generation_{day}.json"
+    annotate(status=status)
     
-    try:
-        with open(log_file, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-    except Exception as e:
-        print(f"Failed to log generation: {e}")
+    with span("log.write", status=status):
+        try:
+            with open(log_file, "a") as f:
+                f.write(json.dumps(log_entry) + "\n")
+        except Exception as e:
+            print(f"Failed to log generation: {e}")
+    
+    # Session records and counters are shared so any worker can answer for them
+    with span("log.shared_state", status=status):
+        try:
+            record = shared_state.get_session(session_id) or {}
+            record.update(details)
+            record.update({"status": status, "updated_at": log_entry["timestamp"]})
+            shared_state.put_session(session_id, record)
+            
+            if status == "completed":
+                metrics.incr(f"generations_completed_{day}")
+                metrics.incr("images_generated", details.get("num_generated", 0))
+        except Exception as e:
+            print(f"Failed to update shared state: {e}")
+
+def seed_counters():
+    """Initialise shared counters from disk the first time any worker starts"""
+    counters = shared_state.counters()
+    
+    if "images_generated" not in counters:
+        results_dir = Path("static/results")
+        shared_state.init_counter("images_generated", len(list(results_dir.glob("*.jpg"))))
+    
+    day = datetime.now().strftime('%Y%m%d')
+    if f"generations_completed_{day}" not in counters:
+        today_log = Path("logs") / f"generation_{day}.json"
+        generations_today = 0
+        if today_log.exists():
+            with open(today_log, 'r') as f:
+                generations_today = sum(1 for line in f if '"status": "completed"' in line)
+        shared_state.init_counter(f"generations_completed_{day}", generations_today)
+
+seed_counters()
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -67,8 +118,230 @@ async def home(request: Request):
         "max_file_size": settings.max_file_size
     })
 
+def cleanup_uploads(*paths):
+    """Remove uploaded input files once a request is done with them"""
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Cleanup warning: {e}")
+
+async def save_result_image(client: httpx.AsyncClient, session_id: str, index: int, image_url: str):
+    """Download a generated image into static/results
+
+    Returns the local path, the original URL if the download failed, or
+    None if the upstream returned an error status.
+    """
+    if image_url.startswith("/static/"):
+        # Local backends already wrote the image into static/results
+        return image_url
+    
+    try:
+        with span("results.download", index=index):
+            img_response = await client.get(image_url)
+            if img_response.status_code == 200:
+                local_path = f"static/results/{session_id}_{index}.jpg"
+                with open(local_path, "wb") as f:
+                    f.write(img_response.content)
+                return f"/{local_path}"
+            return None
+    except Exception as e:
+        print(f"Failed to save image {index}: {e}")
+        # Fallback to original URL
+        return image_url
+
+def record_cancellation(session_id: str, reason: str):
+    """Count and log an abandoned generation"""
+    print(f"🛑 Generation {session_id} cancelled: {reason}")
+    metrics.incr(f"generations_cancelled_{reason}")
+    log_generation(session_id, "cancelled", {"reason": reason})
+
+async def run_until_cancelled(request: Request, deadline: Deadline, coro):
+    """Await coro, cancelling it when the client disconnects or the deadline passes"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=min(DISCONNECT_POLL_INTERVAL, deadline.remaining())
+            )
+            if task in done:
+                return task.result()
+            if deadline.expired:
+                deadline.cancel(DEADLINE_EXCEEDED)
+                break
+            if await request.is_disconnected():
+                deadline.cancel(CLIENT_DISCONNECTED)
+                break
+    except asyncio.CancelledError:
+        deadline.cancel(CLIENT_DISCONNECTED)
+        raise
+    finally:
+        if not task.done():
+            task.cancel()
+    
+    raise GenerationCancelled(deadline.reason)
+
+def client_identity(request: Request, x_client_id: Optional[str]) -> str:
+    """Who a request is fair-queued as: its address, or X-Client-Id behind a trusted gateway"""
+    if settings.scheduler_trust_client_id and x_client_id:
+        return x_client_id
+    return request.client.host if request.client else "anonymous"
+
+@asynccontextmanager
+async def scheduled(client_id: str, params: dict, deadline: Deadline):
+    """Hold a scheduler slot sized by the request's estimated compute"""
+    cost = estimate_cost(
+        params["num_images"], params["num_inference_steps"], params["width"], params["height"]
+    )
+    waiting_since = time.perf_counter()
+    try:
+        async with scheduler.slot(
+            client_id, cost, settings.generation_backend, timeout=deadline.remaining()
+        ) as ticket:
+            add_span("scheduler.wait", waiting_since, time.perf_counter(), cost=cost)
+            yield ticket
+    except QueueTimeout:
+        deadline.cancel(DEADLINE_EXCEEDED)
+        raise GenerationCancelled(DEADLINE_EXCEEDED)
+
+async def stream_generation(
+    session_id: str,
+    generation_service,
+    params: dict,
+    upload_paths: list,
+    deadline: Deadline,
+    client_id: str,
+    trace=None
+):
+    """Yield NDJSON events: started, one image per saved result, then a summary"""
+    # Runs in the response task, so the deadline and trace are bound here rather than in the handler
+    current_deadline.set(deadline)
+    bind_trace(trace)
+    start_time = time.perf_counter()
+    timings = {}
+    saved_images = {}
+    
+    def image_event(index: int, url: str) -> str:
+        if "time_to_first_image" not in timings:
+            timings["time_to_first_image"] = time.perf_counter() - start_time
+        saved_images[index] = url
+        return json.dumps({"event": "image", "index": index, "url": url}) + "\n"
+    
+    try:
+        yield json.dumps({"event": "started", "session_id": session_id}) + "\n"
+        
+        result = {"success": False, "error": "Generation produced no result"}
+        async with scheduled(client_id, params, deadline) as ticket:
+            timings["queue_wait"] = ticket.started_at - ticket.enqueued_at
+            with span("backend.generate", backend=generation_service.name):
+                events = stream_from_backend(generation_service, **params)
+                async for event in iterate_with_deadline(events, deadline):
+                    if event["event"] == "image":
+                        yield image_event(event["index"], event["url"])
+                    else:
+                        result = event["result"]
+            ticket.backend = result.get("backend", ticket.backend)
+            ticket.succeeded = result["success"]
+        
+        if result["success"]:
+            # Download whatever the backend did not already stream, in completion order
+            async def download(index: int, image_url: str):
+                return index, await save_result_image(client, session_id, index, image_url)
+            
+            async with httpx.AsyncClient() as client:
+                downloads = [
+                    asyncio.ensure_future(download(i, image_url))
+                    for i, image_url in enumerate(result["images"])
+                    if i not in saved_images
+                ]
+                try:
+                    for completed in asyncio.as_completed(downloads, timeout=deadline.remaining()):
+                        index, local_url = await completed
+                        if local_url:
+                            yield image_event(index, local_url)
+                except asyncio.TimeoutError:
+                    deadline.cancel(DEADLINE_EXCEEDED)
+                    raise GenerationCancelled(DEADLINE_EXCEEDED)
+                finally:
+                    # Abandoned downloads must not keep writing files
+                    for pending in downloads:
+                        pending.cancel()
+            
+            result["images"] = [saved_images[i] for i in sorted(saved_images)]
+            result["session_id"] = session_id
+            log_generation(session_id, "completed", {
+                "num_generated": len(saved_images),
+                "generation_time": result.get("generation_time", 0),
+                "streamed": True
+            })
+        else:
+            log_generation(session_id, "failed", {
+                "error": result.get("error", "Unknown error")
+            })
+        
+        timings["total"] = time.perf_counter() - start_time
+        yield json.dumps({"event": "summary", **result, "timings": timings}) + "\n"
+        
+    except GenerationCancelled as e:
+        record_cancellation(session_id, e.reason)
+        yield json.dumps({"event": "summary", "success": False, "cancelled": True, "error": e.reason}) + "\n"
+    except asyncio.CancelledError:
+        # The server cancels the response when the client goes away
+        deadline.cancel(CLIENT_DISCONNECTED)
+        record_cancellation(session_id, CLIENT_DISCONNECTED)
+        raise
+    except Exception as e:
+        error_msg = f"Generation failed: {str(e)}"
+        print(f"❌ {error_msg}")
+        log_generation(session_id, "error", {"error": error_msg})
+        yield json.dumps({"event": "summary", "success": False, "error": error_msg}) + "\n"
+    finally:
+        finish_stream(upload_paths, trace)
+
+def finish_stream(upload_paths: list, trace=None):
+    """Remove a stream's uploads and close its trace; safe to call more than once"""
+    cleanup_uploads(*upload_paths)
+    tracer.finish(trace)
+
+class ClosingStreamingResponse(StreamingResponse):
+    """A StreamingResponse that runs on_close however the response ends
+
+    Starlette skips background tasks when the client disconnects, and a body
+    generator that was never iterated never runs its finally block.
+    """
+    
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+ALLOWED_IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/webp']
+
+def validate_image_upload(upload: UploadFile):
+    """Reject uploads that are too large or not a supported image type"""
+    # Validate file size
+    if upload.size > settings.max_file_size:
+        raise HTTPException(
+            status_code=413, 
+            detail=f"File too large. Maximum size is {settings.max_file_size // 1024 // 1024}MB"
+        )
+    
+    # Validate file type
+    if upload.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload JPEG, PNG, or WebP images."
+        )
+
 @app.post("/generate")
 async def generate_story_images(
+    request: Request,
     face_image: UploadFile = File(...),
     mask_image: UploadFile = File(None),
     prompt: str = Form(...),
@@ -77,43 +350,51 @@ async def generate_story_images(
     guidance_scale: float = Form(7.5),
     num_inference_steps: int = Form(25),
     width: int = Form(1024),
-    height: int = Form(1024)
+    height: int = Form(1024),
+    stream: bool = Form(False),
+    x_request_timeout: Optional[str] = Header(None),
+    x_client_id: Optional[str] = Header(None)
 ):
-    """Generate story images using Fal AI"""
+    """Generate story images using the configured backend
+    
+    With stream=true the response is NDJSON and each image is sent as soon
+    as it is saved, followed by a summary event with timings. Work stops
+    when the client disconnects or the X-Request-Timeout header (capped by
+    GENERATION_TIMEOUT) runs out. Requests are admitted by the cost-aware
+    scheduler, fair-queued per client address (or per X-Client-Id when
+    SCHEDULER_TRUST_CLIENT_ID is set).
+    """
     session_id = str(uuid.uuid4())
+    deadline = Deadline.from_header(x_request_timeout)
+    client_id = client_identity(request, x_client_id)
+    face_image_path = None
+    mask_image_path = None
+    cleanup_in_stream = False
+    trace = tracer.start(
+        "generate", session_id=session_id, backend=settings.generation_backend, stream=stream,
+        num_images=num_images, num_inference_steps=num_inference_steps, width=width, height=height
+    )
     
     try:
-        # Validate file size
-        if face_image.size > settings.max_file_size:
-            raise HTTPException(
-                status_code=413, 
-                detail=f"File too large. Maximum size is {settings.max_file_size // 1024 // 1024}MB"
-            )
-        
-        # Validate file type
-        allowed_types = ['image/jpeg', 'image/png', 'image/webp']
-        if face_image.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload JPEG, PNG, or WebP images."
-            )
+        validate_image_upload(face_image)
         
         print(f"🎨 Starting generation for session: {session_id}")
         
-        # Save uploaded face image
-        face_image_path = f"static/input/face_{session_id}.{face_image.filename.split('.')[-1]}"
-        with open(face_image_path, "wb") as buffer:
-            shutil.copyfileobj(face_image.file, buffer)
-        
-        # Save mask image if provided
-        mask_image_path = None
-        if mask_image and mask_image.filename:
-            if mask_image.size > settings.max_file_size:
-                raise HTTPException(status_code=413, detail="Mask image too large")
+        with span("upload.save"):
+            # Save uploaded face image
+            face_image_path = f"static/input/face_{session_id}.{face_image.filename.split('.')[-1]}"
+            with open(face_image_path, "wb") as buffer:
+                shutil.copyfileobj(face_image.file, buffer)
             
-            mask_image_path = f"static/mask/mask_{session_id}.{mask_image.filename.split('.')[-1]}"
-            with open(mask_image_path, "wb") as buffer:
-                shutil.copyfileobj(mask_image.file, buffer)
+            # Save mask image if provided
+            mask_image_path = None
+            if mask_image and mask_image.filename:
+                if mask_image.size > settings.max_file_size:
+                    raise HTTPException(status_code=413, detail="Mask image too large")
+                
+                mask_image_path = f"static/mask/mask_{session_id}.{mask_image.filename.split('.')[-1]}"
+                with open(mask_image_path, "wb") as buffer:
+                    shutil.copyfileobj(mask_image.file, buffer)
         
         # Log generation start
         log_generation(session_id, "started", {
@@ -124,38 +405,56 @@ async def generate_story_images(
             "num_inference_steps": num_inference_steps
         })
         
-        # Generate images using Fal AI
-        result = await fal_service.generate_story_images(
-            face_image_path=face_image_path,
-            mask_image_path=mask_image_path,
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_images=num_images,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            width=width,
-            height=height
-        )
+        generation_service = get_backend(settings.generation_backend)
+        params = {
+            "face_image_path": face_image_path,
+            "mask_image_path": mask_image_path,
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "num_images": num_images,
+            "guidance_scale": guidance_scale,
+            "num_inference_steps": num_inference_steps,
+            "width": width,
+            "height": height,
+            "session_id": session_id
+        }
         
-        if result["success"]:
-            # Save generated images locally
-            saved_images = []
-            for i, image_url in enumerate(result["images"]):
-                try:
-                    # Download image from Fal AI
-                    async with httpx.AsyncClient() as client:
-                        img_response = await client.get(image_url)
-                        if img_response.status_code == 200:
-                            local_path = f"static/results/{session_id}_{i}.jpg"
-                            with open(local_path, "wb") as f:
-                                f.write(img_response.content)
-                            saved_images.append(f"/{local_path}")
-                except Exception as e:
-                    print(f"Failed to save image {i}: {e}")
-                    # Fallback to original URL
-                    saved_images.append(image_url)
+        if stream:
+            # The response owns the uploads from here and removes them however it ends
+            cleanup_in_stream = True
+            upload_paths = [face_image_path, mask_image_path]
+            return ClosingStreamingResponse(
+                stream_generation(
+                    session_id, generation_service, params, upload_paths, deadline, client_id, trace
+                ),
+                on_close=lambda: finish_stream(upload_paths, trace),
+                media_type="application/x-ndjson"
+            )
+        
+        async def generate_and_save():
+            # Generate images using the configured backend once the scheduler admits us
+            async with scheduled(client_id, params, deadline) as ticket:
+                with span("backend.generate", backend=generation_service.name):
+                    result = await generation_service.generate_story_images(**params)
+                ticket.backend = result.get("backend", ticket.backend)
+                ticket.succeeded = result["success"]
             
-            result["images"] = saved_images
+            if result["success"]:
+                # Save generated images locally
+                async with httpx.AsyncClient() as client:
+                    saved_images = await asyncio.gather(*[
+                        save_result_image(client, session_id, i, image_url)
+                        for i, image_url in enumerate(result["images"])
+                    ])
+                result["images"] = [image for image in saved_images if image]
+            return result
+        
+        # Bound before the task is created so backends and worker threads inherit it
+        current_deadline.set(deadline)
+        result = await run_until_cancelled(request, deadline, generate_and_save())
+        
+        if result["success"]:
+            saved_images = result["images"]
             result["session_id"] = session_id
             
             # Log successful generation
@@ -173,6 +472,12 @@ async def generate_story_images(
         
     except HTTPException:
         raise
+    except GenerationCancelled as e:
+        record_cancellation(session_id, e.reason)
+        return JSONResponse(
+            content={"success": False, "cancelled": True, "error": e.reason},
+            status_code=504 if e.reason == DEADLINE_EXCEEDED else 499
+        )
     except Exception as e:
         error_msg = f"Generation failed: {str(e)}"
         print(f"❌ {error_msg}")
@@ -186,27 +491,32 @@ async def generate_story_images(
         )
     finally:
         # Cleanup uploaded files after processing
-        try:
-            if os.path.exists(face_image_path):
-                os.remove(face_image_path)
-            if mask_image_path and os.path.exists(mask_image_path):
-                os.remove(mask_image_path)
-        except Exception as e:
-            print(f"Cleanup warning: {e}")
+        if not cleanup_in_stream:
+            cleanup_uploads(face_image_path, mask_image_path)
+            tracer.finish(trace)
+
+# Caps concurrent Fal face swaps per worker, however many batches are in flight
+face_swap_slots = asyncio.Semaphore(settings.face_swap_concurrency)
+
+def get_face_swap_service():
+    """Return the face swap service selected by FACE_SWAP_BACKEND"""
+    if settings.face_swap_backend == "local":
+        from services.local_face_swap import local_face_swap_service
+        return local_face_swap_service
+    return get_backend("fal")
 
 @app.post("/face-swap")
 async def face_swap(
     face_image: UploadFile = File(...),
     target_image: UploadFile = File(...)
 ):
-    """Perform face swap using Fal AI"""
+    """Perform face swap using the configured face swap backend"""
     session_id = str(uuid.uuid4())
+    face_image_path = f"static/input/face_{session_id}.jpg"
+    target_image_path = f"static/input/target_{session_id}.jpg"
     
     try:
         # Save uploaded images
-        face_image_path = f"static/input/face_{session_id}.jpg"
-        target_image_path = f"static/input/target_{session_id}.jpg"
-        
         with open(face_image_path, "wb") as buffer:
             shutil.copyfileobj(face_image.file, buffer)
         
@@ -214,11 +524,11 @@ async def face_swap(
             shutil.copyfileobj(target_image.file, buffer)
         
         # Perform face swap
-        result = await fal_service.generate_with_face_swap(
+        result = await get_face_swap_service().generate_with_face_swap(
             face_image_path, target_image_path
         )
         
-        if result["success"]:
+        if result["success"] and not result["image"].startswith("/static/"):
             # Save result image
             async with httpx.AsyncClient() as client:
                 img_response = await client.get(result["image"])
@@ -237,9 +547,75 @@ async def face_swap(
         )
     finally:
         # Cleanup
-        for path in [face_image_path, target_image_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        cleanup_uploads(face_image_path, target_image_path)
+
+@app.post("/face-swap/batch")
+async def face_swap_batch(
+    face_image: UploadFile = File(...),
+    target_images: List[UploadFile] = File(...)
+):
+    """Swap one face into many target images
+    
+    The local backend analyses the source face once for the whole batch;
+    the Fal backend runs up to FACE_SWAP_CONCURRENCY swaps at once across
+    all batch requests in this worker.
+    """
+    if len(target_images) > settings.face_swap_max_batch:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many target images. Maximum is {settings.face_swap_max_batch} per batch"
+        )
+    for upload in [face_image, *target_images]:
+        validate_image_upload(upload)
+    
+    session_id = str(uuid.uuid4())
+    face_image_path = f"static/input/face_{session_id}.jpg"
+    target_image_paths = [
+        f"static/input/target_{session_id}_{i}.jpg" for i in range(len(target_images))
+    ]
+    
+    try:
+        with open(face_image_path, "wb") as buffer:
+            shutil.copyfileobj(face_image.file, buffer)
+        
+        for target_image, target_image_path in zip(target_images, target_image_paths):
+            with open(target_image_path, "wb") as buffer:
+                shutil.copyfileobj(target_image.file, buffer)
+        
+        service = get_face_swap_service()
+        if hasattr(service, "swap_batch"):
+            result = await service.swap_batch(face_image_path, target_image_paths, session_id)
+        else:
+            async def swap(target_image_path: str):
+                async with face_swap_slots:
+                    return await service.generate_with_face_swap(face_image_path, target_image_path)
+            
+            swaps = await asyncio.gather(*[swap(target_image_path) for target_image_path in target_image_paths])
+            
+            async def save(index: int, swap: dict):
+                if not swap["success"]:
+                    return None
+                return await save_result_image(client, f"faceswap_{session_id}", index, swap["image"])
+            
+            async with httpx.AsyncClient() as client:
+                images = await asyncio.gather(*[save(i, swap) for i, swap in enumerate(swaps)])
+            result = {
+                "success": any(images),
+                "images": images,
+                "errors": {i: swap["error"] for i, swap in enumerate(swaps) if not swap["success"]},
+                "model_used": "fal-ai/face-swap"
+            }
+        
+        result["session_id"] = session_id
+        return JSONResponse(content=result)
+        
+    except Exception as e:
+        return JSONResponse(
+            content={"success": False, "error": f"Face swap failed: {str(e)}"},
+            status_code=500
+        )
+    finally:
+        cleanup_uploads(face_image_path, *target_image_paths)
 
 @app.get("/gallery")
 async def gallery(request: Request):
@@ -271,6 +647,7 @@ async def health_check():
             "status": "healthy",
             "message": "StoryMaker API is running",
             "fal_api_configured": api_configured,
+            "generation_backend": settings.generation_backend,
             "version": "2.0.0",
             "timestamp": datetime.now().isoformat()
         }
@@ -280,29 +657,61 @@ async def health_check():
             "error": str(e)
         }
 
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Latest status of a generation session, as recorded by any worker"""
+    record = shared_state.get_session(session_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, **record}
+
 @app.get("/stats")
 async def get_stats():
     """Get generation statistics"""
     try:
-        results_dir = Path("static/results")
-        total_images = len(list(results_dir.glob("*.jpg"))) if results_dir.exists() else 0
+        counters = metrics.snapshot()
         
-        # Read today's logs
-        today_log = Path("logs") / f"generation_{datetime.now().strftime('%Y%m%d')}.json"
-        generations_today = 0
+        stats = {
+            "total_images_generated": counters.get("images_generated", 0),
+            "generations_today": counters.get(f"generations_completed_{datetime.now().strftime('%Y%m%d')}", 0),
+            "api_status": "active" if settings.fal_api_key else "not_configured",
+            "generation_backend": settings.generation_backend,
+            "metrics": counters,
+            "scheduler": scheduler.stats()
+        }
         
-        if today_log.exists():
-            with open(today_log, 'r') as f:
-                generations_today = sum(1 for line in f if '"status": "completed"' in line)
+        backend = get_backend(settings.generation_backend)
+        if hasattr(backend, "stats"):
+            stats["backends"] = backend.stats()
         
-        return {
-            "total_images_generated": total_images,
-            "generations_today": generations_today,
-            "api_status": "active" if settings.fal_api_key else "not_configured"
-        }
+        return stats
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/admin/traces")
+async def get_traces(
+    n: int = 10,
+    format: str = "summary",
+    x_admin_key: Optional[str] = Header(None)
+):
+    """The N slowest recent /generate traces held by this worker
+    
+    format=summary returns per-span totals (and profiler hot stacks for
+    sampled slow requests); format=chrome returns Chrome trace-event JSON
+    that loads in chrome://tracing or Perfetto.
+    """
+    if settings.app_secret_key == DEFAULT_SECRET_KEY:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled until APP_SECRET_KEY is set")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key.encode(), settings.app_secret_key.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+    if not tracer.enabled:
+        raise HTTPException(status_code=404, detail="Tracing is disabled. Set TRACING_ENABLED=true")
+    
+    traces = tracer.slowest(max(1, min(n, 100)))
+    if format == "chrome":
+        return {"traces": [trace.to_chrome() for trace in traces]}
+    return {"traces": [trace.summary() for trace in traces]}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
+
+# Placeholder shipped in the examples; admin endpoints stay closed while it is in use
+DEFAULT_SECRET_KEY = "your-secret-key-here"
 
 class Settings:
     """Secure configuration management for StoryMaker"""
@@ -33,10 +36,50 @@ class Settings:
         """Get Fal API key from environment"""
         return os.getenv("FAL_API_KEY")
     
+    @property
+    def shared_state_backend(self) -> str:
+        """Where cross-worker state lives ("sqlite", "redis" or "memory")"""
+        return os.getenv("SHARED_STATE_BACKEND", "sqlite").lower()
+    
+    @property
+    def shared_state_path(self) -> Path:
+        """SQLite database shared by the workers on this host"""
+        return Path(os.getenv("SHARED_STATE_PATH", "logs/shared_state.db"))
+    
+    @property
+    def redis_url(self) -> str:
+        """Redis server used when SHARED_STATE_BACKEND=redis"""
+        return os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    
+    @property
+    def shared_state_record_ttl(self) -> float:
+        """Seconds a session record is kept after its last update"""
+        return float(os.getenv("SHARED_STATE_RECORD_TTL", "604800"))
+    
+    @property
+    def fal_upload_references(self) -> bool:
+        """Upload reference images to Fal storage and send URLs instead of data URIs"""
+        return os.getenv("FAL_UPLOAD_REFERENCES", "True").lower() == "true"
+    
+    @property
+    def fal_storage_url(self) -> str:
+        """Fal storage upload endpoint"""
+        return os.getenv("FAL_STORAGE_URL", "https://rest.alpha.fal.ai/storage/upload")
+    
+    @property
+    def fal_upload_cache_size(self) -> int:
+        """Number of uploaded reference images remembered by content hash"""
+        return int(os.getenv("FAL_UPLOAD_CACHE_SIZE", "256"))
+    
+    @property
+    def fal_upload_ttl(self) -> int:
+        """Seconds an uploaded reference URL is reused across workers"""
+        return int(os.getenv("FAL_UPLOAD_TTL", "86400"))
+    
     @property
     def app_secret_key(self) -> str:
         """Get app secret key"""
-        return os.getenv("APP_SECRET_KEY", "your-secret-key-here")
+        return os.getenv("APP_SECRET_KEY", DEFAULT_SECRET_KEY)
     
     @property
     def debug_mode(self) -> bool:
@@ -52,6 +95,208 @@ class Settings:
     def generation_timeout(self) -> int:
         """Generation timeout in seconds"""
         return int(os.getenv("GENERATION_TIMEOUT", "300"))  # 5 minutes default
+    
+    @property
+    def decode_max_size(self) -> int:
+        """Longest side uploads are decoded to before encoding or inference"""
+        return int(os.getenv("DECODE_MAX_SIZE", "1024"))
+    
+    @property
+    def generation_backend(self) -> str:
+        """Backend used by /generate ("fal", "local", "demo" or "router")"""
+        return os.getenv("GENERATION_BACKEND", "fal").lower()
+    
+    @property
+    def scheduler_max_concurrent(self) -> int:
+        """Generations allowed to run at once; the rest wait in the scheduler queue"""
+        return int(os.getenv("SCHEDULER_MAX_CONCURRENT", "4"))
+    
+    @property
+    def scheduler_interactive_seconds(self) -> float:
+        """Requests expected to finish within this many seconds are served first"""
+        return float(os.getenv("SCHEDULER_INTERACTIVE_SECONDS", "30"))
+    
+    @property
+    def scheduler_max_wait(self) -> float:
+        """Seconds after which a queued batch request is promoted"""
+        return float(os.getenv("SCHEDULER_MAX_WAIT", "120"))
+    
+    @property
+    def scheduler_cost_prior(self) -> float:
+        """Assumed seconds per image-step-megapixel before a backend has been observed"""
+        return float(os.getenv("SCHEDULER_COST_PRIOR", "0.1"))
+    
+    @property
+    def scheduler_trust_client_id(self) -> bool:
+        """Fair-queue by the X-Client-Id header; only safe behind a gateway that sets it"""
+        return os.getenv("SCHEDULER_TRUST_CLIENT_ID", "False").lower() == "true"
+    
+    @property
+    def local_device(self) -> str:
+        """Device for the local pipeline ("auto", "cuda" or "cpu")"""
+        return os.getenv("LOCAL_DEVICE", "auto").lower()
+    
+    @property
+    def cpu_dtype(self) -> str:
+        """Weight dtype on CPU ("auto", "bfloat16" or "float32")"""
+        return os.getenv("CPU_DTYPE", "auto").lower()
+    
+    @property
+    def cpu_channels_last(self) -> bool:
+        """Use channels_last memory format for the UNet and VAE on CPU"""
+        return os.getenv("CPU_CHANNELS_LAST", "True").lower() == "true"
+    
+    @property
+    def cpu_torch_compile(self) -> bool:
+        """Compile the UNet with torch.compile on CPU (slow first request)"""
+        return os.getenv("CPU_TORCH_COMPILE", "False").lower() == "true"
+    
+    @property
+    def cpu_attention_slicing(self) -> bool:
+        """Compute attention in slices to bound peak memory on CPU"""
+        return os.getenv("CPU_ATTENTION_SLICING", "True").lower() == "true"
+    
+    @property
+    def cpu_vae_tiling(self) -> bool:
+        """Decode latents with VAE slicing and tiling to bound peak memory on CPU"""
+        return os.getenv("CPU_VAE_TILING", "True").lower() == "true"
+    
+    @property
+    def cpu_threads(self) -> int:
+        """Intra-op threads per worker (0 splits the cores evenly across workers)"""
+        return int(os.getenv("CPU_THREADS", "0"))
+    
+    @property
+    def cpu_interop_threads(self) -> int:
+        """Inter-op threads per worker"""
+        return int(os.getenv("CPU_INTEROP_THREADS", "1"))
+    
+    @property
+    def cpu_pin_threads(self) -> bool:
+        """Pin each worker to its own slice of cores"""
+        return os.getenv("CPU_PIN_THREADS", "True").lower() == "true"
+    
+    @property
+    def web_concurrency(self) -> int:
+        """Number of uvicorn worker processes sharing this host"""
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    
+    @property
+    def face_swap_backend(self) -> str:
+        """Backend used by /face-swap ("fal" or "local")"""
+        return os.getenv("FACE_SWAP_BACKEND", "fal").lower()
+    
+    @property
+    def face_swap_model(self) -> str:
+        """inswapper ONNX model used by the local face swap backend"""
+        return os.getenv("FACE_SWAP_MODEL", "./checkpoints/inswapper_128.onnx")
+    
+    @property
+    def face_swap_cache_size(self) -> int:
+        """Number of analysed source faces kept by image hash"""
+        return int(os.getenv("FACE_SWAP_CACHE_SIZE", "128"))
+    
+    @property
+    def face_swap_max_size(self) -> int:
+        """Longest side target images are decoded to for local face swap"""
+        return int(os.getenv("FACE_SWAP_MAX_SIZE", "2048"))
+    
+    @property
+    def face_swap_max_batch(self) -> int:
+        """Most target images accepted by one /face-swap/batch request"""
+        return int(os.getenv("FACE_SWAP_MAX_BATCH", "16"))
+    
+    @property
+    def face_swap_concurrency(self) -> int:
+        """Fal face swaps a worker runs at once across all batch requests"""
+        return int(os.getenv("FACE_SWAP_CONCURRENCY", "4"))
+    
+    @property
+    def router_backends(self) -> List[str]:
+        """Backends the latency router splits traffic across, in preference order"""
+        names = os.getenv("ROUTER_BACKENDS", "fal,local")
+        return [name.strip().lower() for name in names.split(",") if name.strip()]
+    
+    @property
+    def router_weights(self) -> List[float]:
+        """Traffic split weights matching ROUTER_BACKENDS (empty means primary only)"""
+        weights = os.getenv("ROUTER_WEIGHTS", "")
+        return [float(weight) for weight in weights.split(",") if weight.strip()]
+    
+    @property
+    def router_p95_threshold(self) -> float:
+        """Observed p95 latency in seconds above which a backend is failed over"""
+        return float(os.getenv("ROUTER_P95_THRESHOLD", "60"))
+    
+    @property
+    def router_window(self) -> int:
+        """Number of recent latencies kept per backend"""
+        return int(os.getenv("ROUTER_WINDOW", "100"))
+    
+    @property
+    def router_probe_rate(self) -> float:
+        """Share of requests sent first to a demoted backend to detect recovery"""
+        return float(os.getenv("ROUTER_PROBE_RATE", "0.05"))
+    
+    @property
+    def router_sample_max_age(self) -> float:
+        """Seconds a latency sample counts towards a backend's p95"""
+        return float(os.getenv("ROUTER_SAMPLE_MAX_AGE", "300"))
+    
+    @property
+    def demo_output_mode(self) -> str:
+        """How demo images are placed in static/results ("link" or "bytes")"""
+        return os.getenv("DEMO_OUTPUT_MODE", "link").lower()
+    
+    @property
+    def demo_cache_dir(self) -> Path:
+        """Directory holding pre-encoded demo images"""
+        return Path(os.getenv("DEMO_CACHE_DIR", "static/results/.demo_cache"))
+    
+    @property
+    def demo_max_size(self) -> int:
+        """Largest width or height the demo backend renders"""
+        return int(os.getenv("DEMO_MAX_SIZE", "2048"))
+    
+    @property
+    def demo_cached_sizes(self) -> int:
+        """Image sizes whose rendered and encoded demo images are kept in memory"""
+        return int(os.getenv("DEMO_CACHED_SIZES", "4"))
+    
+    @property
+    def log_store_dir(self) -> Path:
+        """Directory holding compacted, columnar generation-log partitions"""
+        return Path(os.getenv("LOG_STORE_DIR", "logs/columnar"))
+    
+    @property
+    def tracing_enabled(self) -> bool:
+        """Record per-request span timings for /generate"""
+        return os.getenv("TRACING_ENABLED", "False").lower() == "true"
+    
+    @property
+    def trace_slow_seconds(self) -> float:
+        """Traces at least this long are exported to TRACE_DIR with their profile"""
+        return float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+    
+    @property
+    def trace_profile_rate(self) -> float:
+        """Fraction of traced requests run under the stack-sampling profiler"""
+        return float(os.getenv("TRACE_PROFILE_RATE", "0.1"))
+    
+    @property
+    def trace_profile_interval(self) -> float:
+        """Seconds between profiler stack samples"""
+        return float(os.getenv("TRACE_PROFILE_INTERVAL", "0.01"))
+    
+    @property
+    def trace_dir(self) -> Path:
+        """Where slow traces are exported as Chrome trace JSON"""
+        return Path(os.getenv("TRACE_DIR", "logs/traces"))
+    
+    @property
+    def trace_buffer_size(self) -> int:
+        """Recent traces each worker keeps for /admin/traces"""
+        return int(os.getenv("TRACE_BUFFER_SIZE", "200"))
 
 # Global settings instance
 settings = Settings()
@@ -1,21 +1,177 @@
 import torch
-import numpy as np
-import cv2
-from PIL import Image
 import os
+import socket
+import threading
+import time
 import traceback
 from pathlib import Path
 
+from config.settings import settings
+from services.demo_service import demo_service
+from services import face_analysis
+from services.deadline import GenerationCancelled, check_deadline, get_deadline
+from services.image_decode import decode_bgr, bgr_to_pil
+from services.shared_state import shared_state
+from services.tracing import span
+
 # Try to import the actual StoryMaker pipeline
 try:
     from pipeline_sdxl_storymaker import StableDiffusionXLStoryMakerPipeline
     from diffusers import UniPCMultistepScheduler
-    import insightface
+    # Only probed here: services.face_analysis loads the detector
+    import insightface  # noqa: F401
     PIPELINE_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: StoryMaker pipeline not available: {e}")
     PIPELINE_AVAILABLE = False
 
+BASE_MODEL = 'huaquan/YamerMIX_v11'
+IMAGE_ENCODER_PATH = 'laion/CLIP-ViT-H-14-laion2B-s32B-b79K'
+FACE_ADAPTER = './checkpoints/mask.bin'
+
+# Models stay resident between calls so only the first request pays the load cost
+_pipeline = None
+_load_lock = threading.Lock()
+# The resident pipeline (and its scheduler state) serves one pipe() call at a time
+_pipe_lock = threading.Lock()
+
+_cpu_configured = False
+
+def get_device():
+    """Device the local pipeline runs on"""
+    if settings.local_device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return settings.local_device
+
+def select_cpu_dtype():
+    """Weight dtype for CPU inference: bfloat16 where the CPU supports it, else float32"""
+    if settings.cpu_dtype == 'bfloat16':
+        return torch.bfloat16
+    if settings.cpu_dtype == 'float32':
+        return torch.float32
+    
+    # float16 matmuls are emulated on most CPUs; bfloat16 needs AVX512-BF16/AMX to pay off.
+    # oneDNN's own bf16 check also passes on plain AVX-512, where it is emulated and slower.
+    try:
+        if torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported():
+            return torch.bfloat16
+    except (AttributeError, RuntimeError):
+        pass
+    return torch.float32
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def claim_cpu_slot(workers):
+    """Lease a core slice index for this process, or None if all are held
+    
+    A slot is held by a live PID on this host. A recycled worker's slot is
+    taken over by exactly one replacement: the takeover of a dead PID is
+    itself claimed with an atomic add, so two replacements cannot share it.
+    """
+    host = socket.gethostname()
+    pid = str(os.getpid())
+    for slot in range(workers):
+        key = f"cpu_slot:{host}:{slot}"
+        if shared_state.cache_add(key, pid):
+            return slot
+        holder = shared_state.cache_get(key)
+        if holder == pid:
+            return slot
+        if holder is None or _pid_alive(int(holder)):
+            continue
+        if shared_state.cache_add(f"cpu_slot_takeover:{host}:{slot}:{holder}", pid, ttl=86400):
+            shared_state.cache_set(key, pid)
+            return slot
+    return None
+
+def configure_cpu_runtime():
+    """Size torch thread pools for this worker and pin it to its own cores"""
+    global _cpu_configured
+    if _cpu_configured:
+        return
+    _cpu_configured = True
+    
+    workers = settings.web_concurrency
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    threads = settings.cpu_threads or max(1, len(cores) // workers)
+    
+    if settings.cpu_pin_threads and hasattr(os, 'sched_setaffinity') and len(cores) >= threads * workers:
+        # Each worker leases its own slice of cores so pools do not contend
+        slot = claim_cpu_slot(workers)
+        if slot is None:
+            print("⚠️ No free CPU slot, leaving this worker unpinned")
+        else:
+            os.sched_setaffinity(0, cores[slot * threads:(slot + 1) * threads])
+            print(f"📌 Pinned worker to cores {cores[slot * threads]}-{cores[(slot + 1) * threads - 1]}")
+    
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(settings.cpu_interop_threads)
+    except RuntimeError:
+        # Only settable before the first parallel op in the process
+        pass
+    print(f"🧵 CPU threads: {threads} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+def apply_cpu_optimisations(pipe):
+    """Memory format, bounded-memory attention/VAE and optional compilation for CPU"""
+    if settings.cpu_channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    
+    if settings.cpu_attention_slicing:
+        pipe.enable_attention_slicing()
+    
+    if settings.cpu_vae_tiling:
+        pipe.enable_vae_slicing()
+        pipe.enable_vae_tiling()
+    
+    if settings.cpu_torch_compile:
+        pipe.unet = torch.compile(pipe.unet)
+    return pipe
+
+def get_face_analysis():
+    """Return the resident InsightFace analyser, loading it on first use"""
+    return face_analysis.get_face_analysis(use_gpu=get_device() != 'cpu')
+
+def get_pipeline():
+    """Return the resident StoryMaker pipeline, loading it on first use"""
+    global _pipeline
+    with _load_lock:
+        if _pipeline is None:
+            device = get_device()
+            if device == 'cpu':
+                configure_cpu_runtime()
+                dtype = select_cpu_dtype()
+            else:
+                dtype = torch.float16
+            
+            print(f"🚀 Loading StoryMaker pipeline on {device} ({dtype})...")
+            pipe = StableDiffusionXLStoryMakerPipeline.from_pretrained(
+                BASE_MODEL,
+                torch_dtype=dtype
+            ).to(device)
+            
+            pipe.load_storymaker_adapter(
+                IMAGE_ENCODER_PATH,
+                FACE_ADAPTER,
+                scale=0.8,
+                lora_scale=0.8
+            )
+            
+            pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
+            
+            if device == 'cpu':
+                apply_cpu_optimisations(pipe)
+            _pipeline = pipe
+        return _pipeline
+
 def run_generation(
     face_image_path,
     mask_image_path,
@@ -24,40 +180,50 @@ def run_generation(
     session_id,
     num_images=4,
     guidance_scale=7.5,
-    num_inference_steps=25
+    num_inference_steps=25,
+    width=960,
+    height=1280,
+    output_dir="static/results",
+    on_image_saved=None
 ):
     """
     Run the StoryMaker AI pipeline to generate story images
+    on_image_saved(index, path) is called as soon as each image is written
     """
     try:
         print(f"🎨 Starting generation for session: {session_id}")
         print(f"📝 Prompt: {prompt}")
         print(f"🚫 Negative prompt: {negative_prompt}")
+        start_time = time.perf_counter()
         
         if not PIPELINE_AVAILABLE:
             # Fallback to demo mode with placeholder images
-            return generate_demo_images(session_id, num_images, prompt)
-        
-        # Initialize face analysis
-        print("🤖 Initializing face analysis...")
-        app = insightface.app.FaceAnalysis(
-            name='buffalo_l',
-            root='./',
-            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-        )
-        app.prepare(ctx_id=0, det_size=(640, 640))
-        
-        # Load images
+            return generate_demo_images(
+                session_id, num_images, prompt, width, height, output_dir, on_image_saved
+            )
+        
+        # Check if face adapter exists
+        if not os.path.exists(FACE_ADAPTER):
+            return {
+                "success": False,
+                "error": "Face adapter model (mask.bin) not found. Please download the required checkpoints."
+            }
+        
+        with span("pipeline.load_face_analysis"):
+            app = get_face_analysis()
+        
+        # Load images at reduced scale, decoding each into a single buffer
         print("🖼️ Loading images...")
-        face_image = Image.open(face_image_path).convert('RGB')
-        mask_image = None
-        if mask_image_path:
-            mask_image = Image.open(mask_image_path).convert('RGB')
+        with span("pipeline.decode"):
+            face_array = decode_bgr(face_image_path)
+            mask_image = None
+            if mask_image_path:
+                mask_image = bgr_to_pil(decode_bgr(mask_image_path))
         
         # Detect face
         print("👤 Detecting face...")
-        face_array = cv2.cvtColor(np.array(face_image), cv2.COLOR_RGB2BGR)
-        face_info = app.get(face_array)
+        with span("pipeline.detect_face"):
+            face_info = app.get(face_array)
         
         if not face_info:
             return {
@@ -71,62 +237,57 @@ def run_generation(
             key=lambda x: (x['bbox'][2] - x['bbox'][0]) * (x['bbox'][3] - x['bbox'][1])
         )[-1]
         
-        print("🚀 Loading StoryMaker pipeline...")
-        
-        # Load the StoryMaker pipeline
-        base_model = 'huaquan/YamerMIX_v11'
-        image_encoder_path = 'laion/CLIP-ViT-H-14-laion2B-s32B-b79K'
-        face_adapter = './checkpoints/mask.bin'
-        
-        # Check if face adapter exists
-        if not os.path.exists(face_adapter):
-            return {
-                "success": False,
-                "error": "Face adapter model (mask.bin) not found. Please download the required checkpoints."
-            }
-        
-        pipe = StableDiffusionXLStoryMakerPipeline.from_pretrained(
-            base_model,
-            torch_dtype=torch.float16
-        ).to('cuda' if torch.cuda.is_available() else 'cpu')
+        # Reuse the detection buffer as the RGB image for the pipeline
+        face_image = bgr_to_pil(face_array)
         
-        pipe.load_storymaker_adapter(
-            image_encoder_path,
-            face_adapter,
-            scale=0.8,
-            lora_scale=0.8
-        )
-        
-        pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
+        with span("pipeline.load"):
+            pipe = get_pipeline()
         
         # Generate images
         print(f"🎭 Generating {num_images} story images...")
-        generator = torch.Generator(device='cuda' if torch.cuda.is_available() else 'cpu').manual_seed(666)
+        generator = torch.Generator(device=get_device()).manual_seed(666)
+        
+        deadline = get_deadline()
+        
+        def stop_if_cancelled(pipeline, step, timestep, callback_kwargs):
+            # Abandoned requests stop at the next denoising step
+            if deadline:
+                deadline.check()
+            return callback_kwargs
         
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
         generated_images = []
         
         for i in range(num_images):
+            check_deadline()
             print(f"🖼️ Generating image {i+1}/{num_images}...")
             
-            output = pipe(
-                image=face_image,
-                mask_image=mask_image,
-                face_info=face_info,
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                ip_adapter_scale=0.8,
-                lora_scale=0.8,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                height=1280,
-                width=960,
-                generator=generator,
-            ).images[0]
+            # A cancelled caller may already have let the next request in;
+            # its pipe() call still runs until the next step callback
+            with _pipe_lock, span("pipeline.inference", index=i, steps=num_inference_steps):
+                output = pipe(
+                    image=face_image,
+                    mask_image=mask_image,
+                    face_info=face_info,
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    ip_adapter_scale=0.8,
+                    lora_scale=0.8,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    height=height,
+                    width=width,
+                    generator=generator,
+                    callback_on_step_end=stop_if_cancelled,
+                ).images[0]
             
             # Save generated image
-            output_path = f'static/results/{session_id}_{i}.jpg'
-            output.save(output_path)
+            output_path = f'{output_dir}/{session_id}_{i}.jpg'
+            with span("pipeline.save", index=i):
+                output.save(output_path)
             generated_images.append(f'/{output_path}')
+            if on_image_saved:
+                on_image_saved(i, f'/{output_path}')
             
             print(f"✅ Saved image {i+1} to {output_path}")
         
@@ -135,9 +296,14 @@ def run_generation(
             "images": generated_images,
             "session_id": session_id,
             "face_detected": True,
-            "num_generated": len(generated_images)
+            "num_generated": len(generated_images),
+            "generation_time": time.perf_counter() - start_time,
+            "model_used": "storymaker-local"
         }
         
+    except GenerationCancelled as e:
+        print(f"🛑 Generation cancelled for session {session_id}: {e.reason}")
+        raise
     except Exception as e:
         print(f"❌ Error in generation: {str(e)}")
         print(traceback.format_exc())
@@ -146,41 +312,18 @@ def run_generation(
             "error": f"Generation failed: {str(e)}"
         }
 
-def generate_demo_images(session_id, num_images, prompt):
+def generate_demo_images(
+    session_id,
+    num_images,
+    prompt,
+    width=960,
+    height=1280,
+    output_dir="static/results",
+    on_image_saved=None
+):
     """
     Generate demo placeholder images when the actual pipeline is not available
     """
-    print("🎭 Running in demo mode - generating placeholder images...")
-    
-    generated_images = []
-    
-    for i in range(num_images):
-        # Create a simple colored image as placeholder
-        img = Image.new('RGB', (960, 1280), color=(100 + i*30, 150 + i*20, 200 + i*10))
-        
-        # Add some text to make it look like a generated image
-        from PIL import ImageDraw, ImageFont
-        draw = ImageDraw.Draw(img)
-        
-        try:
-            # Try to use a default font
-            font = ImageFont.load_default()
-        except:
-            font = None
-        
-        text = f"Demo Story Image {i+1}\n\nPrompt: {prompt[:50]}..."
-        draw.text((50, 50), text, fill=(255, 255, 255), font=font)
-        
-        # Save the demo image
-        output_path = f'static/results/{session_id}_{i}.jpg'
-        img.save(output_path)
-        generated_images.append(f'/{output_path}')
-    
-    return {
-        "success": True,
-        "images": generated_images,
-        "session_id": session_id,
-        "face_detected": True,
-        "num_generated": len(generated_images),
-        "demo_mode": True
-    }
+    return demo_service.generate_images(
+        session_id, num_images, prompt, width, height, output_dir, on_image_saved
+    )
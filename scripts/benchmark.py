@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for StoryMaker
+Each subcommand measures one part of the stack and prints a summary table
+"""
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Allow running as `python scripts/benchmark.py` from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def print_table(title, rows):
+    """Print rows of (label, value) pairs"""
+    print(f"\n📊 {title}")
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f"  {label.ljust(width)}  {value}")
+
+def make_test_image(width=512, height=512):
+    """Encode a synthetic JPEG upload"""
+    from PIL import Image
+    buffered = io.BytesIO()
+    Image.new('RGB', (width, height), color=(180, 140, 120)).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+def benchmark_generate(args):
+    """Time-to-first-byte and time-to-first-image for /generate against a running server"""
+    import httpx
+
+    upload = make_test_image()
+    data = {
+        "prompt": "a person reading a book under a cherry blossom tree",
+        "num_images": str(args.num_images),
+        "num_inference_steps": str(args.steps),
+        "width": str(args.size),
+        "height": str(args.size),
+    }
+
+    results = {"buffered": {"ttfb": [], "ttfi": [], "total": []},
+               "stream": {"ttfb": [], "ttfi": [], "total": []}}
+
+    with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+        for mode in ("buffered", "stream"):
+            for _ in range(args.requests):
+                files = {"face_image": ("face.jpg", upload, "image/jpeg")}
+                form = dict(data, stream="true" if mode == "stream" else "false")
+                start = time.perf_counter()
+                ttfb = ttfi = None
+
+                with client.stream("POST", "/generate", data=form, files=files) as response:
+                    if mode == "stream":
+                        for line in response.iter_lines():
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - start
+                            if line and ttfi is None and json.loads(line).get("event") == "image":
+                                ttfi = time.perf_counter() - start
+                    else:
+                        for _chunk in response.iter_bytes():
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - start
+                        # A buffered response carries every image at once
+                        ttfi = time.perf_counter() - start
+
+                total = time.perf_counter() - start
+                results[mode]["ttfb"].append(ttfb or total)
+                results[mode]["ttfi"].append(ttfi or total)
+                results[mode]["total"].append(total)
+
+    for mode, samples in results.items():
+        print_table(f"/generate ({mode}, {args.requests} requests)", [
+            (f"{metric} p50 / p95", f"{statistics.median(values):.3f}s / {percentile(values, 0.95):.3f}s")
+            for metric, values in samples.items()
+        ])
+
+def make_photo_jpeg(path, megapixels):
+    """Write a noisy 3:2 JPEG of roughly the given size so it compresses like a photo"""
+    import numpy as np
+    from PIL import Image
+
+    width = int((megapixels * 1_000_000 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    pixels = gradient + rng.normal(0, 20, (height, width, 3)).astype(np.float32)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=90)
+    return width, height
+
+def _peak_rss_kb():
+    """Peak RSS of this address space in KB
+
+    VmHWM starts afresh at exec, unlike ru_maxrss which a spawned child
+    inherits from its parent's high-water mark.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmHWM not reported by /proc/self/status")
+
+def _reset_peak_rss():
+    """Lower VmHWM to the current RSS so the next reading covers only what follows"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def _decode_peak_rss(mode, path, queue):
+    """Child process: report extra peak RSS (KB) and time for one decode"""
+    if mode.startswith("legacy"):
+        import numpy as np
+        import cv2
+        from PIL import Image
+    else:
+        from services.image_decode import decode_bgr, encode_jpeg
+
+    _reset_peak_rss()
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+
+    if mode == "legacy-encode":
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=90)
+    elif mode == "legacy-pipeline":
+        face_image = Image.open(path).convert('RGB')
+        cv2.cvtColor(np.array(face_image), cv2.COLOR_RGB2BGR)
+    elif mode == "reduced-encode":
+        encode_jpeg(path, max_size=1024)
+    elif mode == "reduced-pipeline":
+        decode_bgr(path, max_size=1024)
+
+    elapsed = time.perf_counter() - start
+    queue.put((_peak_rss_kb() - baseline, elapsed))
+
+def benchmark_decode(args):
+    """Peak RSS per upload decode vs. input megapixels, legacy vs. reduce-on-load (Linux only)"""
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context("spawn")
+    modes = ["legacy-encode", "reduced-encode", "legacy-pipeline", "reduced-pipeline"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.megapixels:
+            path = str(Path(tmp_dir) / f"upload_{megapixels}mp.jpg")
+            width, height = make_photo_jpeg(path, megapixels)
+            rows = []
+            for mode in modes:
+                queue = context.Queue()
+                process = context.Process(target=_decode_peak_rss, args=(mode, path, queue))
+                process.start()
+                extra_kb, elapsed = queue.get()
+                process.join()
+                rows.append((mode, f"{extra_kb / 1024:7.1f} MB peak RSS  {elapsed * 1000:7.1f} ms"))
+            print_table(f"decode {width}x{height} ({megapixels} MP, {Path(path).stat().st_size // 1024} KB)", rows)
+
+def benchmark_transport(args):
+    """Request bytes and client CPU per scene: inline base64 data URIs vs. uploaded references"""
+    import asyncio
+    import os
+    import tempfile
+
+    # The stub accepts any key; the real one is never sent anywhere
+    os.environ.setdefault("FAL_API_KEY", "stub-key")
+    from services.fal_service import FalAIService
+    from services.fal_stub import FalStub
+    from services.shared_state import create_shared_state
+
+    async def run_scenes(service, face_path):
+        for scene in range(args.scenes):
+            result = await service.generate_story_images(
+                face_image_path=face_path, prompt=f"scene {scene}", num_images=1
+            )
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        face_path = str(Path(tmp_dir) / "face.jpg")
+        make_photo_jpeg(face_path, args.megapixels)
+
+        for mode in ("inline", "upload"):
+            stub = FalStub()
+            # A fresh stub knows none of the URLs a persistent shared state remembers
+            service = FalAIService(transport=stub.transport, state=create_shared_state("memory"))
+            service.upload_references = mode == "upload"
+
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            asyncio.run(run_scenes(service, face_path))
+            cpu = time.process_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+
+            total_bytes = sum(stub.request_bytes)
+            print_table(f"transport {mode} ({args.scenes} scenes, {args.megapixels} MP face)", [
+                ("requests", str(len(stub.requests))),
+                ("request bytes total", f"{total_bytes / 1024:.1f} KB"),
+                ("request bytes / scene", f"{total_bytes / args.scenes / 1024:.1f} KB"),
+                ("client CPU / scene", f"{cpu / args.scenes * 1000:.2f} ms"),
+                ("wall / scene", f"{wall / args.scenes * 1000:.2f} ms"),
+            ])
+
+def _shared_state_worker(backend, path, url, requests, worker_id, queue):
+    """Child process: replay the shared-state calls a /generate request makes"""
+    from services.shared_state import RedisSharedState, SQLiteSharedState
+
+    state = SQLiteSharedState(path) if backend == "sqlite" else RedisSharedState(url=url)
+    latencies = []
+    for i in range(requests):
+        session_id = f"{worker_id}-{i}"
+        start = time.perf_counter()
+        state.put_session(session_id, {"status": "started"})
+        state.cache_get(f"fal_upload:{i % 16}")
+        record = state.get_session(session_id) or {}
+        record.update({"status": "completed", "num_generated": 4})
+        state.put_session(session_id, record)
+        state.incr("bench_generations_completed")
+        state.incr("bench_images_generated", 4)
+        latencies.append(time.perf_counter() - start)
+    queue.put(latencies)
+
+def benchmark_shared_state(args):
+    """Per-request shared-state overhead with 1, 4 and 16 concurrent worker processes"""
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context("spawn")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / "shared_state.db")
+            if args.backend == "sqlite":
+                from services.shared_state import SQLiteSharedState
+                state = SQLiteSharedState(path)
+            else:
+                from services.shared_state import RedisSharedState
+                state = RedisSharedState(url=args.redis_url, prefix=f"bench:{time.time_ns()}:")
+            before = state.counters().get("bench_generations_completed", 0)
+
+            queue = context.Queue()
+            processes = [
+                context.Process(
+                    target=_shared_state_worker,
+                    args=(args.backend, path, args.redis_url, args.requests, worker_id, queue)
+                )
+                for worker_id in range(workers)
+            ]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            latencies = [value for _ in processes for value in queue.get()]
+            for process in processes:
+                process.join()
+            wall = time.perf_counter() - start
+
+            completed = state.counters().get("bench_generations_completed", 0) - before
+            print_table(f"shared state {args.backend}, {workers} workers x {args.requests} requests", [
+                ("per-request p50 / p95", f"{statistics.median(latencies) * 1000:.3f} ms / {percentile(latencies, 0.95) * 1000:.3f} ms"),
+                ("aggregate throughput", f"{len(latencies) / wall:.0f} requests/s"),
+                ("counter check", f"{completed} of {workers * args.requests} increments"),
+            ])
+
+CPU_CONFIGS = {
+    "fp32": {"CPU_DTYPE": "float32", "CPU_CHANNELS_LAST": "False",
+             "CPU_ATTENTION_SLICING": "False", "CPU_VAE_TILING": "False", "CPU_TORCH_COMPILE": "False"},
+    "bf16": {"CPU_DTYPE": "bfloat16", "CPU_CHANNELS_LAST": "False",
+             "CPU_ATTENTION_SLICING": "False", "CPU_VAE_TILING": "False", "CPU_TORCH_COMPILE": "False"},
+    "bf16-channels-last": {"CPU_DTYPE": "bfloat16", "CPU_CHANNELS_LAST": "True",
+                           "CPU_ATTENTION_SLICING": "False", "CPU_VAE_TILING": "False", "CPU_TORCH_COMPILE": "False"},
+    "bf16-bounded-memory": {"CPU_DTYPE": "bfloat16", "CPU_CHANNELS_LAST": "True",
+                            "CPU_ATTENTION_SLICING": "True", "CPU_VAE_TILING": "True", "CPU_TORCH_COMPILE": "False"},
+    "bf16-compile": {"CPU_DTYPE": "bfloat16", "CPU_CHANNELS_LAST": "True",
+                     "CPU_ATTENTION_SLICING": "True", "CPU_VAE_TILING": "True", "CPU_TORCH_COMPILE": "True"},
+}
+
+def _cpu_config_worker(config, face_image, steps, size, output_dir, queue):
+    """Child process: load the pipeline with one CPU configuration and time a generation"""
+    import os
+
+    os.environ.update(CPU_CONFIGS[config])
+    os.environ.update({"LOCAL_DEVICE": "cpu", "CPU_PIN_THREADS": "False"})
+    import pipeline_runner
+
+    def generate(num_steps):
+        result = pipeline_runner.run_generation(
+            face_image, None, "a person reading a book in a library", "", f"bench_{config}",
+            num_images=1, num_inference_steps=num_steps, width=size, height=size, output_dir=output_dir
+        )
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+
+    load_start = time.perf_counter()
+    pipeline_runner.get_pipeline()
+    load_time = time.perf_counter() - load_start
+
+    # Warm-up pays for compilation and allocator growth outside the timed run
+    generate(2)
+    start = time.perf_counter()
+    generate(steps)
+    elapsed = time.perf_counter() - start
+
+    queue.put((load_time, elapsed / steps, _peak_rss_kb()))
+
+def benchmark_cpu(args):
+    """Seconds per step and peak RSS of the local pipeline for each CPU configuration"""
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for config in args.configs:
+            queue = context.Queue()
+            process = context.Process(
+                target=_cpu_config_worker,
+                args=(config, args.face_image, args.steps, args.size, tmp_dir, queue)
+            )
+            process.start()
+            load_time, seconds_per_step, peak_kb = queue.get()
+            process.join()
+            rows.append((config, f"{seconds_per_step:6.2f} s/step  {peak_kb / 1024 / 1024:5.2f} GB peak RSS  load {load_time:.0f}s"))
+
+    print_table(f"local pipeline on CPU ({args.size}x{args.size}, {args.steps} steps)", rows)
+
+def write_synthetic_logs(log_dir, days, sessions_per_day):
+    """Write daily generation logs shaped like the ones app.log_generation produces"""
+    import random
+    from datetime import datetime, timedelta
+
+    rng = random.Random(0)
+    errors = ["API error: 502 - Bad Gateway", "Generation timeout. Please try again with fewer images or simpler prompts.",
+              "Generation failed: CUDA out of memory", "No face detected in the uploaded image"]
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    for day in range(days):
+        start = first_day + timedelta(days=day)
+        with open(Path(log_dir) / f"generation_{start.strftime('%Y%m%d')}.json", "w") as f:
+            for i in range(sessions_per_day):
+                session_id = f"{day}-{i}"
+                at = start + timedelta(seconds=i * 86000 / sessions_per_day)
+                num_images = rng.choice([1, 2, 4, 8])
+                f.write(json.dumps({"timestamp": at.isoformat(), "session_id": session_id, "status": "started",
+                                    "details": {"prompt": "a person reading a book", "negative_prompt": "bad quality",
+                                                "num_images": num_images, "guidance_scale": 7.5,
+                                                "num_inference_steps": rng.choice([20, 25, 30])}}) + "\n")
+                roll = rng.random()
+                if roll < 0.9:
+                    status, details = "completed", {"num_generated": num_images,
+                                                    "generation_time": rng.lognormvariate(1.5, 0.4) * num_images}
+                elif roll < 0.98:
+                    status, details = "failed", {"error": rng.choice(errors)}
+                else:
+                    status, details = "cancelled", {"reason": "deadline_exceeded"}
+                f.write(json.dumps({"timestamp": (at + timedelta(seconds=5)).isoformat(), "session_id": session_id,
+                                    "status": status, "details": details}) + "\n")
+
+def _raw_log_scan(log_dir):
+    """Baseline: answer the same three questions by parsing every JSONL line"""
+    from collections import Counter, defaultdict
+    from datetime import datetime
+
+    sessions = {}
+    for log_file in sorted(Path(log_dir).glob("generation_*.json")):
+        with open(log_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                row = sessions.setdefault(entry["session_id"], {"timestamp": entry["timestamp"]})
+                row[entry["status"]] = entry["details"]
+
+    latencies = defaultdict(list)
+    failures = Counter()
+    hours = Counter()
+    for row in sessions.values():
+        hours[datetime.fromisoformat(row["timestamp"]).strftime("%Y-%m-%d %H")] += 1
+        if "completed" in row:
+            latencies[row.get("started", {}).get("num_images")].append(row["completed"]["generation_time"])
+        elif "failed" in row:
+            failures[row["failed"]["error"].split(":")[0]] += 1
+    return {key: percentile(values, 0.95) for key, values in latencies.items()}, failures, hours
+
+def benchmark_logs(args):
+    """Raw JSONL scan vs. compacted columnar partitions for the log analytics queries"""
+    import tempfile
+    from services import log_store
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_dir, store_dir = Path(tmp_dir) / "logs", Path(tmp_dir) / "columnar"
+        log_dir.mkdir()
+        write_synthetic_logs(log_dir, args.days, args.sessions)
+
+        raw_times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            _raw_log_scan(log_dir)
+            raw_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        log_store.compact(log_dir, store_dir)
+        compact_time = time.perf_counter() - start
+
+        columnar_times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            table = log_store.load(store_dir=store_dir)
+            log_store.latency_percentiles(table, "num_images")
+            log_store.failure_rates(table)
+            log_store.throughput_per_hour(table)
+            columnar_times.append(time.perf_counter() - start)
+
+        raw_bytes = sum(path.stat().st_size for path in log_dir.glob("*.json"))
+        columnar_bytes = sum(path.stat().st_size for path in store_dir.glob("*.npz"))
+        raw, columnar = statistics.median(raw_times), statistics.median(columnar_times)
+        print_table(f"log analytics, {args.days} days x {args.sessions} sessions", [
+            ("raw JSONL scan (median)", f"{raw * 1000:.1f} ms"),
+            ("columnar load + queries (median)", f"{columnar * 1000:.1f} ms"),
+            ("speedup", f"{raw / columnar:.1f}x"),
+            ("one-off compaction", f"{compact_time * 1000:.1f} ms"),
+            ("size on disk", f"{raw_bytes / 1e6:.1f} MB JSONL -> {columnar_bytes / 1e6:.1f} MB columnar"),
+        ])
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryMaker benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="TTFB/TTFI of /generate, buffered vs streaming")
+    generate.add_argument("--url", default="http://localhost:7860")
+    generate.add_argument("--requests", type=int, default=10)
+    generate.add_argument("--num-images", type=int, default=4)
+    generate.add_argument("--steps", type=int, default=25)
+    generate.add_argument("--size", type=int, default=1024)
+    generate.add_argument("--timeout", type=float, default=600)
+    generate.set_defaults(func=benchmark_generate)
+
+    decode = subparsers.add_parser("decode", help="Peak RSS per upload decode vs. input megapixels")
+    decode.add_argument("--megapixels", type=float, nargs="+", default=[1, 6, 12, 24])
+    decode.set_defaults(func=benchmark_decode)
+
+    transport = subparsers.add_parser("transport", help="Request bytes and CPU, base64 payloads vs. uploaded references")
+    transport.add_argument("--scenes", type=int, default=8)
+    transport.add_argument("--megapixels", type=float, default=6)
+    transport.set_defaults(func=benchmark_transport)
+
+    shared = subparsers.add_parser("shared-state", help="Shared-state overhead per request across worker processes")
+    shared.add_argument("--backend", choices=["sqlite", "redis"], default="sqlite")
+    shared.add_argument("--redis-url", default="redis://localhost:6379/0")
+    shared.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    shared.add_argument("--requests", type=int, default=500)
+    shared.set_defaults(func=benchmark_shared_state)
+
+    cpu = subparsers.add_parser("cpu", help="Seconds per step and peak RSS for each CPU inference configuration")
+    cpu.add_argument("--face-image", required=True, help="Photo with a detectable face")
+    cpu.add_argument("--configs", nargs="+", choices=list(CPU_CONFIGS), default=list(CPU_CONFIGS))
+    cpu.add_argument("--steps", type=int, default=10)
+    cpu.add_argument("--size", type=int, default=768)
+    cpu.set_defaults(func=benchmark_cpu)
+
+    logs = subparsers.add_parser("logs", help="Log analytics over raw JSONL vs. compacted columnar partitions")
+    logs.add_argument("--days", type=int, default=7)
+    logs.add_argument("--sessions", type=int, default=20000, help="Sessions per day")
+    logs.add_argument("--repeats", type=int, default=3)
+    logs.set_defaults(func=benchmark_logs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,222 @@
 """
 Model installation script for StoryMaker
 Downloads and sets up all required models and checkpoints
+
+Checkpoints are listed in scripts/models_manifest.json. They are fetched
+concurrently into a shared artifact cache, resumed with HTTP Range requests
+after interruptions, verified against their SHA-256 (when pinned) and then
+atomically placed into checkpoints/. Point --mirror (or a manifest URL) at
+a local HTTP server to provision from a LAN mirror or to test the fetcher:
+
+    python tests/range_server.py 8000 /path/to/artifacts
+    python scripts/install_models.py --mirror http://localhost:8000 --skip-deps
+
+(python -m http.server also works as a mirror, but it ignores Range, so an
+interrupted download restarts instead of resuming.) Processes sharing a
+cache take a lock per artifact, so concurrent installs never write the same
+partial file.
+
+Use --verify to check an existing install without touching the network; it
+fails on a missing or mismatched file and warns about unpinned ones.
 """
 
+import argparse
+import hashlib
+import json
 import os
+import shutil
 import sys
+import time
+import urllib.error
 import urllib.request
-import zipfile
-import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 import subprocess
 
-def download_file(url, destination):
-    """Download a file with progress indication"""
-    print(f"📥 Downloading {os.path.basename(destination)}...")
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the cache is then safe for one process only
+    fcntl = None
+
+DEFAULT_MANIFEST = Path(__file__).resolve().parent / "models_manifest.json"
+DEFAULT_CACHE_DIR = Path(os.getenv("STORYMAKER_ARTIFACT_CACHE", Path.home() / ".cache" / "storymaker" / "artifacts"))
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTEMPTS = 4
+
+class ChecksumError(Exception):
+    """Raised when a downloaded artifact does not match its pinned SHA-256"""
+
+def load_manifest(manifest_path):
+    """Read the artifact list from a manifest file"""
+    with open(manifest_path, "r") as f:
+        return json.load(f)["artifacts"]
+
+def sha256_file(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path_for(artifact, cache_dir):
+    """Cache location of an artifact: by checksum when pinned, else by URL"""
+    if artifact.get("sha256"):
+        return cache_dir / "sha256" / artifact["sha256"]
+    url_hash = hashlib.sha256(artifact["url"].encode()).hexdigest()[:16]
+    return cache_dir / "unpinned" / f"{url_hash}_{artifact['name']}"
+
+def verify_artifact(artifact, path):
+    """Return an error message if path is missing or does not match the manifest"""
+    if not path.exists():
+        return "missing"
+    if artifact.get("size") and path.stat().st_size != artifact["size"]:
+        return f"size {path.stat().st_size} != {artifact['size']}"
+    if artifact.get("sha256"):
+        actual = sha256_file(path)
+        if actual != artifact["sha256"]:
+            return f"sha256 {actual} != {artifact['sha256']}"
+    return None
+
+@contextmanager
+def cache_lock(path):
+    """Hold an exclusive lock on path's .lock file across processes sharing the cache"""
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def download_file(url, destination, expected_size=None):
+    """Download url into destination, resuming from a partial .part file"""
+    part_path = destination.with_name(destination.name + ".part")
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        request = urllib.request.Request(url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                if offset and response.status != 206:
+                    # Server ignored the Range header; start over
+                    offset = 0
+                mode = "ab" if offset else "wb"
+                with open(part_path, mode) as f:
+                    shutil.copyfileobj(response, f, CHUNK_SIZE)
+            os.replace(part_path, destination)
+            return
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                if expected_size and offset == expected_size:
+                    # The partial file already holds the whole body
+                    os.replace(part_path, destination)
+                    return
+                # The partial file is longer than the body, or its length cannot be checked
+                part_path.unlink()
+                if attempt < MAX_ATTEMPTS:
+                    continue
+            if attempt == MAX_ATTEMPTS or 400 <= e.code < 500:
+                raise
+        except (urllib.error.URLError, OSError):
+            if attempt == MAX_ATTEMPTS:
+                raise
+
+        wait = 2 ** attempt
+        print(f"🔁 Retrying {destination.name} in {wait}s (resuming at {part_path.stat().st_size if part_path.exists() else 0} bytes)...")
+        time.sleep(wait)
+
+def place_atomically(source, destination):
+    """Link or copy a cached artifact into place so readers never see a partial file"""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
     try:
-        urllib.request.urlretrieve(url, destination)
-        print(f"✅ Downloaded {os.path.basename(destination)}")
-        return True
-    except Exception as e:
-        print(f"❌ Failed to download {os.path.basename(destination)}: {e}")
-        return False
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+def fetch_artifact(artifact, cache_dir, mirror=None, root=Path(".")):
+    """Make sure one artifact is cached, verified and installed; returns a status line"""
+    name = artifact["name"]
+    destination = root / artifact["destination"]
+
+    if verify_artifact(artifact, destination) is None:
+        return f"✅ {name} already installed"
+
+    cached = cache_path_for(artifact, cache_dir)
+    # Another process may be filling the same cache entry; wait for it, then re-check
+    with cache_lock(cached):
+        if verify_artifact(artifact, cached) is not None:
+            urls = ([f"{mirror.rstrip('/')}/{name}"] if mirror else []) + [artifact["url"]]
+            last_error = None
+            for url in urls:
+                try:
+                    print(f"📥 Downloading {name} from {url}...")
+                    download_file(url, cached, artifact.get("size"))
+                    last_error = None
+                    break
+                except Exception as e:
+                    last_error = e
+                    print(f"⚠️  {name}: {url} failed: {e}")
+            if last_error is not None:
+                raise last_error
+
+            problem = verify_artifact(artifact, cached)
+            if problem:
+                cached.unlink()
+                raise ChecksumError(f"{name}: {problem}")
+            if not artifact.get("sha256"):
+                print(f"⚠️  {name} has no pinned sha256 (downloaded {sha256_file(cached)})")
+
+    place_atomically(cached, destination)
+    return f"✅ Installed {name} -> {destination}"
+
+def download_storymaker_checkpoints(manifest_path=DEFAULT_MANIFEST, cache_dir=DEFAULT_CACHE_DIR, mirror=None, jobs=4):
+    """Download StoryMaker specific checkpoints concurrently"""
+    print("📦 Setting up StoryMaker checkpoints...")
+    artifacts = load_manifest(manifest_path)
+
+    success = True
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {
+            executor.submit(fetch_artifact, artifact, Path(cache_dir), mirror): artifact
+            for artifact in artifacts
+        }
+        for future in as_completed(futures):
+            artifact = futures[future]
+            try:
+                print(future.result())
+            except Exception as e:
+                print(f"❌ Failed to install {artifact['name']}: {e}")
+                success = False
+
+    return success
+
+def verify_install(manifest_path=DEFAULT_MANIFEST, root=Path(".")):
+    """Check installed checkpoints against the manifest without network access"""
+    print("🔍 Verifying installed checkpoints...")
+    success = True
+    for artifact in load_manifest(manifest_path):
+        problem = verify_artifact(artifact, root / artifact["destination"])
+        if problem:
+            print(f"❌ {artifact['name']}: {problem}")
+            success = False
+        elif artifact.get("sha256"):
+            print(f"✅ {artifact['name']} verified")
+        else:
+            # Presence says nothing about a file the manifest cannot check
+            print(f"⚠️  {artifact['name']} present but unverified; pin its sha256 and size (currently {sha256_file(root / artifact['destination'])})")
+    return success
 
 def setup_insightface_models():
     """Setup InsightFace models"""
@@ -36,36 +232,10 @@ def setup_insightface_models():
         print(f"❌ Failed to setup InsightFace models: {e}")
         return False
 
-def download_storymaker_checkpoints():
-    """Download StoryMaker specific checkpoints"""
-    print("📦 Setting up StoryMaker checkpoints...")
-    
-    checkpoints_dir = Path("checkpoints")
-    checkpoints_dir.mkdir(exist_ok=True)
-    
-    # Note: Replace these URLs with actual checkpoint URLs when available
-    checkpoints = {
-        "mask.bin": "https://example.com/mask.bin",  # Replace with actual URL
-        # Add more checkpoints as needed
-    }
-    
-    success = True
-    for filename, url in checkpoints.items():
-        destination = checkpoints_dir / filename
-        if not destination.exists():
-            print(f"⚠️  Checkpoint {filename} not found. Please download manually from:")
-            print(f"   {url}")
-            print(f"   Save to: {destination}")
-            success = False
-        else:
-            print(f"✅ Checkpoint {filename} already exists")
-    
-    return success
-
 def install_python_dependencies():
     """Install Python dependencies"""
     print("📚 Installing Python dependencies...")
-    
+
     requirements = [
         "torch>=2.0.0",
         "torchvision>=0.15.0",
@@ -76,6 +246,7 @@ def install_python_dependencies():
         "transformers>=4.30.0",
         "diffusers>=0.20.0",
         "insightface>=0.7.3",
+        "onnxruntime>=1.16.0",
         "accelerate>=0.20.0",
         "fastapi>=0.100.0",
         "uvicorn>=0.23.0",
@@ -84,11 +255,10 @@ def install_python_dependencies():
         "aiofiles>=23.0.0",
         "safetensors>=0.3.0",
     ]
-    
+
     try:
-        for requirement in requirements:
-            print(f"Installing {requirement}...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", requirement])
+        # One resolver run for everything instead of one pip process per package
+        subprocess.check_call([sys.executable, "-m", "pip", "install", *requirements])
         print("✅ All Python dependencies installed!")
         return True
     except subprocess.CalledProcessError as e:
@@ -97,35 +267,55 @@ def install_python_dependencies():
 
 def main():
     """Main installation function"""
+    parser = argparse.ArgumentParser(description="Install StoryMaker models and checkpoints")
+    parser.add_argument("--manifest", type=Path, default=DEFAULT_MANIFEST, help="Artifact manifest (JSON)")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="Shared artifact cache directory")
+    parser.add_argument("--mirror", help="Base URL tried before each artifact's own URL")
+    parser.add_argument("--jobs", type=int, default=4, help="Concurrent downloads")
+    parser.add_argument("--verify", action="store_true", help="Verify the existing install without network access")
+    parser.add_argument("--skip-deps", action="store_true", help="Do not pip install dependencies")
+    parser.add_argument("--skip-insightface", action="store_true", help="Do not prepare InsightFace models")
+    args = parser.parse_args()
+
+    if args.verify:
+        return verify_install(args.manifest)
+
     print("🚀 Starting StoryMaker installation...")
-    
+
     # Create necessary directories
     directories = ["static/input", "static/mask", "static/results", "models", "checkpoints", "templates"]
     for directory in directories:
         Path(directory).mkdir(parents=True, exist_ok=True)
         print(f"📁 Created directory: {directory}")
-    
-    # Install Python dependencies
-    if not install_python_dependencies():
-        print("❌ Failed to install Python dependencies")
-        return False
-    
+
+    # Download checkpoints alongside the dependency install
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        checkpoints = executor.submit(
+            download_storymaker_checkpoints, args.manifest, args.cache_dir, args.mirror, args.jobs
+        )
+
+        # Install Python dependencies
+        if not args.skip_deps and not install_python_dependencies():
+            print("❌ Failed to install Python dependencies")
+            return False
+
+        checkpoints_ok = checkpoints.result()
+
     # Setup InsightFace models
-    if not setup_insightface_models():
+    if not args.skip_insightface and not setup_insightface_models():
         print("❌ Failed to setup InsightFace models")
         return False
-    
-    # Download StoryMaker checkpoints
-    if not download_storymaker_checkpoints():
-        print("⚠️  Some checkpoints are missing. Please download them manually.")
-    
+
+    if not checkpoints_ok:
+        print("⚠️  Some checkpoints could not be installed. Re-run to resume their downloads.")
+
     print("🎉 Installation completed!")
     print("\n📋 Next steps:")
-    print("1. Download the required checkpoints (mask.bin) if not already done")
+    print("1. Check the install with: python scripts/install_models.py --verify")
     print("2. Run: uvicorn app:app --host 0.0.0.0 --port 7860")
     print("3. Open http://localhost:7860 in your browser")
-    
-    return True
+
+    return checkpoints_ok
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
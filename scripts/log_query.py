@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Generation-log analytics for StoryMaker
+Compacts daily logs/generation_YYYYMMDD.json files into columnar partitions
+and runs aggregations over them
+
+    python scripts/log_query.py compact
+    python scripts/log_query.py latency --by num_images --days 7
+    python scripts/log_query.py failures --days 1
+    python scripts/log_query.py throughput --since 2024-06-01 --json
+"""
+
+import argparse
+import json
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+# Allow running as `python scripts/log_query.py` from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import log_store
+
+def print_rows(title, rows):
+    """Print a list of dicts as an aligned table"""
+    print(f"\n📊 {title}")
+    if not rows:
+        print("  (no data)")
+        return
+    headers = list(rows[0])
+    cells = [[f"{value:.3f}" if isinstance(value, float) else str(value) for value in row.values()] for row in rows]
+    widths = [max(len(header), *(len(line[i]) for line in cells)) for i, header in enumerate(headers)]
+    print("  " + "  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+    for line in cells:
+        print("  " + "  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+def load_table(args):
+    """Load the partitions selected by --since/--until/--days"""
+    since = date.fromisoformat(args.since) if args.since else None
+    if args.days:
+        since = date.today() - timedelta(days=args.days - 1)
+    until = date.fromisoformat(args.until) if args.until else None
+    return log_store.load(since, until, args.store_dir)
+
+def command_compact(args):
+    written = log_store.compact(args.log_dir, args.store_dir, include_today=args.include_today, force=args.force)
+    for partition in written:
+        print(f"✅ Compacted {partition}")
+    if not written:
+        print("✅ All closed logs are already compacted")
+
+def command_latency(args):
+    table = load_table(args)
+    return f"generation_time by {args.by} ({len(table)} sessions)", log_store.latency_percentiles(
+        table, args.by, args.percentiles
+    )
+
+def command_failures(args):
+    table = load_table(args)
+    return f"failure rates by error type ({len(table)} sessions)", log_store.failure_rates(table)
+
+def command_throughput(args):
+    table = load_table(args)
+    return f"throughput per hour ({len(table)} sessions)", log_store.throughput_per_hour(table)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store-dir", type=Path, default=None, help="Partition directory (default: LOG_STORE_DIR)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact = subparsers.add_parser("compact", help="Convert closed daily logs into columnar partitions")
+    compact.add_argument("--log-dir", type=Path, default=Path("logs"))
+    compact.add_argument("--include-today", action="store_true", help="Also compact today's still-open log")
+    compact.add_argument("--force", action="store_true", help="Rewrite partitions that are up to date")
+    compact.set_defaults(func=command_compact)
+
+    queries = {
+        "latency": ("generation_time percentiles of completed sessions", command_latency),
+        "failures": ("Failure rates by error type", command_failures),
+        "throughput": ("Sessions, completions and images per hour", command_throughput),
+    }
+    for name, (description, func) in queries.items():
+        query = subparsers.add_parser(name, help=description)
+        query.add_argument("--since", help="First day (YYYY-MM-DD)")
+        query.add_argument("--until", help="Last day (YYYY-MM-DD)")
+        query.add_argument("--days", type=int, help="Only the last N days, including today")
+        query.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+        if name == "latency":
+            query.add_argument("--by", choices=log_store.GROUP_COLUMNS, default="num_images")
+            query.add_argument("--percentiles", type=float, nargs="+", default=[50, 95, 99])
+        query.set_defaults(func=func)
+
+    args = parser.parse_args()
+    output = args.func(args)
+    if output is None:
+        return
+    title, rows = output
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_rows(title, rows)
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,41 @@
-import torch
-import numpy as np
-import cv2
-from PIL import Image
+import contextlib
 import sys
 import json
+import time
+from pathlib import Path
+
+# Run the shared StoryMaker pipeline from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# stdout carries the JSON result; import-time warnings about missing packages go to stderr too
+with contextlib.redirect_stdout(sys.stderr):
+    import pipeline_runner
 
 def run_generation(face_image_path, mask_image_path, prompt, negative_prompt, output_prefix):
     """
     Main function to run the StoryMaker pipeline
-    This would integrate with your actual AI models
+    Delegates to the shared pipeline_runner and writes into public/generated
+    for the Next.js frontend
     """
-    try:
-        # In a real implementation, you would:
-        
-        # 1. Initialize FaceAnalysis
-        # app = FaceAnalysis(name='buffalo_l', root='./', providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-        # app.prepare(ctx_id=0, det_size=(640, 640))
-        
-        # 2. Load and process images
-        # face_image = Image.open(face_image_path).convert('RGB')
-        # mask_image = Image.open(mask_image_path).convert('RGB') if mask_image_path else None
-        
-        # 3. Detect face
-        # face_info = app.get(cv2.cvtColor(np.array(face_image), cv2.COLOR_RGB2BGR))
-        # face_info = sorted(face_info, key=lambda x:(x['bbox'][2]-x['bbox'][0])*(x['bbox'][3]-x['bbox'][1]))[-1]
-        
-        # 4. Load StoryMaker pipeline
-        # base_model = 'huaquan/YamerMIX_v11'
-        # image_encoder_path = 'laion/CLIP-ViT-H-14-laion2B-s32B-b79K'
-        # face_adapter = './checkpoints/mask.bin'
-        
-        # pipe = StableDiffusionXLStoryMakerPipeline.from_pretrained(
-        #     base_model,
-        #     torch_dtype=torch.float16
-        # ).to('cuda')
-        
-        # pipe.load_storymaker_adapter(image_encoder_path, face_adapter, scale=0.8, lora_scale=0.8)
-        
-        # 5. Generate images
-        # generator = torch.Generator(device='cuda').manual_seed(666)
-        # for i in range(4):
-        #     output = pipe(
-        #         image=face_image, 
-        #         mask_image=mask_image, 
-        #         face_info=face_info,
-        #         prompt=prompt,
-        #         negative_prompt=negative_prompt,
-        #         ip_adapter_scale=0.8, 
-        #         lora_scale=0.8,
-        #         num_inference_steps=25,
-        #         guidance_scale=7.5,
-        #         height=1280, 
-        #         width=960,
-        #         generator=generator,
-        #     ).images[0]
-        #     output.save(f'public/generated/{output_prefix}_{i}.jpg')
-        
-        # For now, return success with placeholder paths
-        output_paths = [f'public/generated/{output_prefix}_{i}.jpg' for i in range(4)]
-        
-        return {
-            'success': True,
-            'images': output_paths,
-            'face_detected': True,
-            'processing_time': 25.5
-        }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+    start_time = time.perf_counter()
+
+    # Keep progress output off stdout, which carries the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = pipeline_runner.run_generation(
+            face_image_path,
+            mask_image_path,
+            prompt,
+            negative_prompt,
+            output_prefix,
+            output_dir='public/generated'
+        )
+
+    if result.get('success'):
+        # The frontend expects paths relative to the project root
+        result['images'] = [path.lstrip('/') for path in result['images']]
+        result['processing_time'] = time.perf_counter() - start_time
+
+    return result
 
 if __name__ == "__main__":
     # Parse command line arguments
@@ -79,6 +44,6 @@ if __name__ == "__main__":
     prompt = sys.argv[3]
     negative_prompt = sys.argv[4]
     output_prefix = sys.argv[5]
-    
+
     result = run_generation(face_image_path, mask_image_path, prompt, negative_prompt, output_prefix)
     print(json.dumps(result))
@@ -25,7 +25,7 @@ if [ ! -f ".env" ]; then
 FAL_API_KEY=your-fal-api-key-here
 
 # Application Settings
-APP_SECRET_KEY=storymaker-secret-key-2024
+APP_SECRET_KEY=$(python -c 'import secrets; print(secrets.token_urlsafe(32))')
 DEBUG=False
 MAX_FILE_SIZE=10485760
 GENERATION_TIMEOUT=300
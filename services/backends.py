@@ -0,0 +1,284 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Protocol, Tuple, runtime_checkable
+from config.settings import settings
+from services.deadline import GenerationCancelled
+
+@dataclass(frozen=True)
+class BackendCapabilities:
+    """Features a generation backend supports"""
+    supports_batching: bool = False
+    supports_masks: bool = False
+    supports_streaming: bool = False
+
+@runtime_checkable
+class GenerationBackend(Protocol):
+    """Interface shared by every image generation backend
+
+    Results are dicts with at least "success" and either "images" (remote
+    URLs or /static/results paths) or "error". Backends that set
+    supports_streaming also provide stream_story_images(), an async iterator
+    taking the same arguments and yielding {"event": "image", "index", "url"}
+    as each image is saved, followed by one {"event": "result", "result"}.
+    """
+    name: str
+    capabilities: BackendCapabilities
+
+    async def generate_story_images(
+        self,
+        face_image_path: str,
+        prompt: str,
+        negative_prompt: str = "",
+        mask_image_path: Optional[str] = None,
+        num_images: int = 4,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 25,
+        width: int = 1024,
+        height: int = 1024,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        ...
+
+async def stream_from_thread(
+    run: Callable[[Callable[[int, str], None]], Dict[str, Any]]
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run a blocking generator function in a thread and stream its saved images
+
+    run receives an on_image_saved(index, path) callback and returns the result dict.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_image_saved(index: int, path: str) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, {"event": "image", "index": index, "url": path})
+
+    task = asyncio.ensure_future(asyncio.to_thread(run, on_image_saved))
+    # Completion is scheduled after every image callback, so it arrives last
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+
+        yield {"event": "result", "result": await task}
+    finally:
+        if not task.done():
+            # The consumer went away; the thread stops at its next deadline check
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def stream_from_backend(backend: GenerationBackend, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+    """Stream events from any backend, wrapping non-streaming ones in a single result event"""
+    if backend.capabilities.supports_streaming:
+        async for event in backend.stream_story_images(**kwargs):
+            yield event
+        return
+
+    yield {"event": "result", "result": await backend.generate_story_images(**kwargs)}
+
+_factories: Dict[str, Callable[[], GenerationBackend]] = {}
+_instances: Dict[str, GenerationBackend] = {}
+
+def register_backend(name: str, factory: Callable[[], GenerationBackend]) -> None:
+    """Register a backend factory under a settings name"""
+    _factories[name] = factory
+    _instances.pop(name, None)
+
+def get_backend(name: Optional[str] = None) -> GenerationBackend:
+    """Return the backend registered under name, creating it on first use"""
+    name = name or settings.generation_backend
+    if name not in _instances:
+        if name not in _factories:
+            raise ValueError(f"Unknown generation backend: {name}")
+        _instances[name] = _factories[name]()
+    return _instances[name]
+
+class LatencyRouter:
+    """Routes requests across backends by weight, failing over on slow p95 or errors"""
+
+    name = "router"
+
+    def __init__(
+        self,
+        backend_names: List[str],
+        weights: Optional[List[float]] = None,
+        p95_threshold: Optional[float] = None,
+        window: Optional[int] = None,
+        probe_rate: Optional[float] = None,
+        sample_max_age: Optional[float] = None
+    ):
+        if not backend_names:
+            raise ValueError("LatencyRouter needs at least one backend")
+        if "router" in backend_names:
+            raise ValueError("LatencyRouter cannot route to itself")
+
+        self.backend_names = backend_names
+        # Without explicit weights all traffic goes to the first healthy backend
+        self.weights = weights if weights and len(weights) == len(backend_names) else None
+        self.p95_threshold = p95_threshold if p95_threshold is not None else settings.router_p95_threshold
+        # Demoted backends get this share of requests so recovery is noticed
+        self.probe_rate = probe_rate if probe_rate is not None else settings.router_probe_rate
+        self.sample_max_age = sample_max_age if sample_max_age is not None else settings.router_sample_max_age
+        window = window or settings.router_window
+        # (monotonic time, seconds) per request; old samples stop counting towards p95
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = {
+            name: deque(maxlen=window) for name in backend_names
+        }
+
+    def _backend_capabilities(self, name: str) -> Optional[BackendCapabilities]:
+        """Capabilities of a routed backend, or None if it cannot be created"""
+        try:
+            return get_backend(name).capabilities
+        except Exception as e:
+            print(f"⚠️ Backend {name} unavailable: {e}")
+            return None
+
+    @property
+    def capabilities(self) -> BackendCapabilities:
+        """A capability is offered if any routed backend offers it"""
+        caps = [c for c in map(self._backend_capabilities, self.backend_names) if c]
+        return BackendCapabilities(
+            supports_batching=any(c.supports_batching for c in caps),
+            supports_masks=any(c.supports_masks for c in caps),
+            supports_streaming=any(c.supports_streaming for c in caps)
+        )
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record an observed request latency for a backend"""
+        self._latencies[name].append((time.monotonic(), seconds))
+
+    def _recent(self, name: str) -> List[float]:
+        """Latencies observed within sample_max_age seconds"""
+        cutoff = time.monotonic() - self.sample_max_age
+        samples = self._latencies[name]
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return [seconds for _, seconds in samples]
+
+    def p95(self, name: str) -> Optional[float]:
+        """Recent p95 latency of a backend, or None without recent samples"""
+        samples = sorted(self._recent(name))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-backend recent sample count and p95 for /stats"""
+        return {
+            name: {"samples": len(self._recent(name)), "p95": self.p95(name)}
+            for name in self.backend_names
+        }
+
+    def _candidates(self, needs_mask: bool) -> List[str]:
+        """Order backends for a request: a weighted pick of the healthy ones first"""
+        eligible = []
+        for index, name in enumerate(self.backend_names):
+            capabilities = self._backend_capabilities(name)
+            if capabilities is None or (needs_mask and not capabilities.supports_masks):
+                continue
+            eligible.append((index, name))
+
+        healthy = [(i, n) for i, n in eligible if (self.p95(n) or 0) <= self.p95_threshold]
+        slow = sorted(
+            [(i, n) for i, n in eligible if (self.p95(n) or 0) > self.p95_threshold],
+            key=lambda item: self.p95(item[1])
+        )
+
+        ordered = [name for _, name in healthy]
+        if self.weights and len(healthy) > 1:
+            first = random.choices(ordered, weights=[self.weights[i] for i, _ in healthy])[0]
+            ordered.remove(first)
+            ordered.insert(0, first)
+
+        demoted = [name for _, name in slow]
+        if demoted and ordered and random.random() < self.probe_rate:
+            # Probe a demoted backend; the healthy ones remain as failover
+            probe = random.choice(demoted)
+            demoted.remove(probe)
+            ordered.insert(0, probe)
+
+        return ordered + demoted
+
+    async def generate_story_images(self, face_image_path: str, prompt: str, **kwargs) -> Dict[str, Any]:
+        """Try backends in routing order until one succeeds"""
+        candidates = self._candidates(needs_mask=bool(kwargs.get("mask_image_path")))
+        if not candidates:
+            return {"success": False, "error": "No generation backend supports this request"}
+
+        result: Dict[str, Any] = {}
+        for name in candidates:
+            start_time = time.perf_counter()
+            try:
+                result = await get_backend(name).generate_story_images(
+                    face_image_path=face_image_path, prompt=prompt, **kwargs
+                )
+            except GenerationCancelled:
+                # An abandoned request must not fail over to another backend
+                raise
+            except Exception as e:
+                result = {"success": False, "error": f"Backend {name} failed: {str(e)}"}
+            self.record(name, time.perf_counter() - start_time)
+
+            if result.get("success"):
+                result["backend"] = name
+                return result
+            print(f"⚠️ Backend {name} failed, trying next: {result.get('error')}")
+
+        return result
+
+    async def stream_story_images(self, face_image_path: str, prompt: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Stream from backends in routing order, failing over only before the first image"""
+        candidates = self._candidates(needs_mask=bool(kwargs.get("mask_image_path")))
+        if not candidates:
+            yield {"event": "result", "result": {"success": False, "error": "No generation backend supports this request"}}
+            return
+
+        result: Dict[str, Any] = {}
+        for position, name in enumerate(candidates):
+            start_time = time.perf_counter()
+            images_sent = False
+            try:
+                async for event in stream_from_backend(
+                    get_backend(name), face_image_path=face_image_path, prompt=prompt, **kwargs
+                ):
+                    if event["event"] == "image":
+                        images_sent = True
+                        yield event
+                    else:
+                        result = event["result"]
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                result = {"success": False, "error": f"Backend {name} failed: {str(e)}"}
+            self.record(name, time.perf_counter() - start_time)
+
+            if result.get("success") or images_sent or position == len(candidates) - 1:
+                result["backend"] = name
+                yield {"event": "result", "result": result}
+                return
+            print(f"⚠️ Backend {name} failed, trying next: {result.get('error')}")
+
+def _fal_backend() -> GenerationBackend:
+    from services.fal_service import fal_service
+    return fal_service
+
+def _local_backend() -> GenerationBackend:
+    from services.local_pipeline_service import local_pipeline_service
+    return local_pipeline_service
+
+def _demo_backend() -> GenerationBackend:
+    from services.demo_service import demo_service
+    return demo_service
+
+def _router_backend() -> GenerationBackend:
+    return LatencyRouter(settings.router_backends, settings.router_weights)
+
+register_backend("fal", _fal_backend)
+register_backend("local", _local_backend)
+register_backend("demo", _demo_backend)
+register_backend("router", _router_backend)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Optional
+from config.settings import settings
+
+# Cancellation reasons, also used as metric names
+CLIENT_DISCONNECTED = "client_disconnected"
+DEADLINE_EXCEEDED = "deadline_exceeded"
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is abandoned before it finishes"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Deadline:
+    """Overall time budget and cancellation flag for one request
+
+    Safe to check from worker threads, so local pipeline steps can stop at
+    step boundaries once the client is gone or the budget is spent.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> "Deadline":
+        """Build a deadline from a client timeout header, capped by GENERATION_TIMEOUT"""
+        timeout = float(settings.generation_timeout)
+        if value:
+            try:
+                timeout = min(timeout, max(0.0, float(value)))
+            except ValueError:
+                pass
+        return cls(timeout)
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        """True once cancelled explicitly or past the deadline"""
+        return self._cancelled.is_set() or self.expired
+
+    def cancel(self, reason: str) -> None:
+        """Mark the request as abandoned; the first reason wins"""
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def check(self) -> None:
+        """Raise GenerationCancelled if the request should stop"""
+        if self.expired:
+            self.cancel(DEADLINE_EXCEEDED)
+        if self._cancelled.is_set():
+            raise GenerationCancelled(self.reason)
+
+# Deadline of the request being served; copied into worker threads by asyncio.to_thread
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+def get_deadline() -> Optional[Deadline]:
+    """Deadline of the current request, if any"""
+    return current_deadline.get()
+
+def check_deadline() -> None:
+    """Raise GenerationCancelled if the current request should stop"""
+    deadline = current_deadline.get()
+    if deadline:
+        deadline.check()
+
+def request_timeout(default: float) -> float:
+    """HTTP timeout for an upstream call, bounded by the current deadline"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    return max(0.001, min(default, deadline.remaining()))
+
+async def iterate_with_deadline(events: AsyncIterator[Any], deadline: Deadline) -> AsyncIterator[Any]:
+    """Re-yield an async iterator, cancelling it once the deadline passes"""
+    iterator = events.__aiter__()
+    while True:
+        try:
+            event = await asyncio.wait_for(iterator.__anext__(), deadline.remaining())
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            deadline.cancel(DEADLINE_EXCEEDED)
+            raise GenerationCancelled(DEADLINE_EXCEEDED)
+        yield event
@@ -0,0 +1,205 @@
+import asyncio
+import io
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Any, Optional, Tuple
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from config.settings import settings
+from services.backends import BackendCapabilities, stream_from_thread
+from services.deadline import check_deadline
+
+# Per-variation colour offsets applied on top of the base image
+VARIATION_STEP = np.array([30, 20, 10], dtype=np.int16)
+VARIATION_PERIOD = 5
+
+class DemoImageService:
+    """Offline placeholder generator used for demo mode and load tests"""
+
+    name = "demo"
+    capabilities = BackendCapabilities(supports_batching=True, supports_streaming=True)
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        output_mode: Optional[str] = None,
+        max_size: Optional[int] = None,
+        cached_sizes: Optional[int] = None
+    ):
+        self.cache_dir = Path(cache_dir or settings.demo_cache_dir)
+        self.output_mode = output_mode or settings.demo_output_mode
+        self.max_size = max_size or settings.demo_max_size
+        self.cached_sizes = cached_sizes or settings.demo_cached_sizes
+        self._font = ImageFont.load_default()
+        # Sizes come from requests, so only the most recently used few stay resident
+        self._base_images: "OrderedDict[Tuple[int, int], np.ndarray]" = OrderedDict()
+        self._encoded: "OrderedDict[Tuple[int, int, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    def _cache_get(self, cache: OrderedDict, key: Tuple[int, ...]) -> Any:
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key: Tuple[int, ...], value: Any, limit: int) -> None:
+        with self._cache_lock:
+            cache[key] = value
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def _render_base(self, width: int, height: int) -> np.ndarray:
+        """Render the base placeholder for a size once and keep it as an array"""
+        base = self._cache_get(self._base_images, (width, height))
+        if base is not None:
+            return base
+
+        img = Image.new('RGB', (width, height), color=(100, 150, 200))
+        draw = ImageDraw.Draw(img)
+        draw.text((50, 50), "Demo Story Image", fill=(255, 255, 255), font=self._font)
+
+        base = np.asarray(img, dtype=np.uint8)
+        base.setflags(write=False)
+        self._cache_put(self._base_images, (width, height), base, self.cached_sizes)
+        return base
+
+    def get_image_bytes(self, width: int, height: int, index: int) -> bytes:
+        """Return the pre-encoded JPEG for a size and variation"""
+        variation = index % VARIATION_PERIOD
+        key = (width, height, variation)
+
+        encoded = self._cache_get(self._encoded, key)
+        if encoded is not None:
+            return encoded
+
+        with self._lock:
+            encoded = self._cache_get(self._encoded, key)
+            if encoded is not None:
+                return encoded
+
+            base = self._render_base(width, height)
+            offset = VARIATION_STEP * variation
+            pixels = np.add(base, offset, dtype=np.int16)
+            np.clip(pixels, 0, 255, out=pixels)
+
+            buffered = io.BytesIO()
+            Image.fromarray(pixels.astype(np.uint8)).save(buffered, format="JPEG", quality=90)
+            encoded = buffered.getvalue()
+            self._cache_put(self._encoded, key, encoded, self.cached_sizes * VARIATION_PERIOD)
+            return encoded
+
+    def _cached_file(self, width: int, height: int, index: int) -> Path:
+        """Write the encoded variation to the on-disk cache once"""
+        variation = index % VARIATION_PERIOD
+        cache_path = self.cache_dir / f"{width}x{height}_{variation}.jpg"
+        if not cache_path.exists():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(self.get_image_bytes(width, height, index))
+            os.replace(tmp_path, cache_path)
+        return cache_path
+
+    def save_image(self, output_path: str, width: int, height: int, index: int) -> None:
+        """Place a demo image at output_path without re-encoding it"""
+        if self.output_mode == "link":
+            try:
+                os.link(self._cached_file(width, height, index), output_path)
+                return
+            except OSError:
+                # Cross-device or unsupported filesystem; fall back to a plain write
+                pass
+
+        with open(output_path, "wb") as f:
+            f.write(self.get_image_bytes(width, height, index))
+
+    def generate_images(
+        self,
+        session_id: str,
+        num_images: int,
+        prompt: str,
+        width: int = 960,
+        height: int = 1280,
+        output_dir: str = "static/results",
+        on_image_saved: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
+        """Generate demo placeholder images for a session"""
+        print("🎭 Running in demo mode - generating placeholder images...")
+        start_time = time.perf_counter()
+
+        if not (0 < width <= self.max_size and 0 < height <= self.max_size):
+            return {
+                "success": False,
+                "error": f"Demo images must be between 1 and {self.max_size} pixels per side"
+            }
+
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        generated_images = []
+        for i in range(num_images):
+            check_deadline()
+            output_path = f'{output_dir}/{session_id}_{i}.jpg'
+            self.save_image(output_path, width, height, i)
+            generated_images.append(f'/{output_path}')
+            if on_image_saved:
+                on_image_saved(i, f'/{output_path}')
+
+        return {
+            "success": True,
+            "images": generated_images,
+            "session_id": session_id,
+            "face_detected": True,
+            "num_generated": len(generated_images),
+            "generation_time": time.perf_counter() - start_time,
+            "model_used": "demo",
+            "prompt": prompt,
+            "demo_mode": True
+        }
+
+    async def generate_story_images(
+        self,
+        face_image_path: str,
+        prompt: str,
+        negative_prompt: str = "",
+        mask_image_path: Optional[str] = None,
+        num_images: int = 4,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 25,
+        width: int = 1024,
+        height: int = 1024,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Generate demo images with the same interface as FalAIService"""
+        session_id = session_id or str(uuid.uuid4())
+        return await asyncio.to_thread(
+            self.generate_images, session_id, num_images, prompt, width, height
+        )
+
+    async def stream_story_images(
+        self,
+        face_image_path: str,
+        prompt: str,
+        negative_prompt: str = "",
+        mask_image_path: Optional[str] = None,
+        num_images: int = 4,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 25,
+        width: int = 1024,
+        height: int = 1024,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield an image event per saved placeholder, then the full result"""
+        session_id = session_id or str(uuid.uuid4())
+        async for event in stream_from_thread(
+            lambda on_image_saved: self.generate_images(
+                session_id, num_images, prompt, width, height, on_image_saved=on_image_saved
+            )
+        ):
+            yield event
+
+# Global service instance
+demo_service = DemoImageService()
@@ -0,0 +1,34 @@
+import threading
+
+try:
+    import insightface
+    FACE_ANALYSIS_AVAILABLE = True
+except ImportError as e:
+    print(f"Warning: face analysis not available: {e}")
+    FACE_ANALYSIS_AVAILABLE = False
+
+# One buffalo_l per process: the StoryMaker pipeline and local face swap share it
+_face_analysis = None
+_load_lock = threading.Lock()
+
+def get_face_analysis(use_gpu: bool = False):
+    """Return the resident InsightFace analyser, loading it on first use
+
+    The first caller picks the execution provider; later callers share that
+    instance rather than loading a second copy of the model.
+    """
+    global _face_analysis
+    with _load_lock:
+        if _face_analysis is None:
+            if not FACE_ANALYSIS_AVAILABLE:
+                raise ValueError("Face analysis requires insightface and onnxruntime")
+            print("🤖 Initializing face analysis...")
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+            app = insightface.app.FaceAnalysis(
+                name='buffalo_l',
+                root='./',
+                providers=providers
+            )
+            app.prepare(ctx_id=0 if use_gpu else -1, det_size=(640, 640))
+            _face_analysis = app
+        return _face_analysis
@@ -1,22 +1,47 @@
 import asyncio
 import base64
-import io
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
 from typing import List, Dict, Any, Optional
-from PIL import Image
 import httpx
 from config.settings import settings
+from services.backends import BackendCapabilities
+from services.deadline import check_deadline, request_timeout
+from services.image_decode import encode_jpeg
+from services.shared_state import SharedState, shared_state
+from services.tracing import span
 
 class FalAIService:
     """Service for integrating with Fal AI API"""
     
-    def __init__(self):
+    name = "fal"
+    capabilities = BackendCapabilities(supports_batching=True, supports_masks=True)
+    
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        state: Optional[SharedState] = None
+    ):
         self.api_key = settings.fal_api_key
         self.base_url = "https://fal.run/fal-ai"
+        self.storage_url = settings.fal_storage_url
         self.timeout = settings.generation_timeout
+        self.upload_references = settings.fal_upload_references
+        # Optional transport override, used to run against services.fal_stub
+        self.transport = transport
+        # Cross-worker cache of uploaded URLs; injectable so benchmarks stay isolated
+        self.state = state or shared_state
+        # Content hash of an uploaded reference image -> its Fal storage URL
+        self._uploaded: "OrderedDict[str, str]" = OrderedDict()
         
         if not self.api_key:
             raise ValueError("FAL_API_KEY not found in environment variables")
     
+    def _client(self) -> httpx.AsyncClient:
+        """Create an HTTP client whose timeout respects the request deadline"""
+        return httpx.AsyncClient(timeout=request_timeout(self.timeout), transport=self.transport)
+    
     def _get_headers(self) -> Dict[str, str]:
         """Get HTTP headers with authentication"""
         return {
@@ -27,24 +52,126 @@ class FalAIService:
     def _encode_image_to_base64(self, image_path: str) -> str:
         """Encode image file to base64 string"""
         try:
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Resize if too large
-                max_size = 1024
-                if max(img.size) > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # Convert to base64
-                buffered = io.BytesIO()
-                img.save(buffered, format="JPEG", quality=90)
-                img_str = base64.b64encode(buffered.getvalue()).decode()
+            with span("fal.encode_inline"):
+                # Decoded at reduced scale, resized to at most 1024px and re-encoded
+                img_bytes = encode_jpeg(image_path, max_size=1024, quality=90)
+                img_str = base64.b64encode(img_bytes).decode()
                 return f"data:image/jpeg;base64,{img_str}"
         except Exception as e:
             raise ValueError(f"Failed to process image: {str(e)}")
     
+    async def _upload_image(self, client: httpx.AsyncClient, image_bytes: bytes, file_name: str) -> str:
+        """Upload JPEG bytes to Fal storage and return the file URL"""
+        with span("fal.upload", bytes=len(image_bytes)):
+            response = await client.post(
+                f"{self.storage_url}/initiate",
+                headers=self._get_headers(),
+                json={"content_type": "image/jpeg", "file_name": file_name}
+            )
+            response.raise_for_status()
+            upload = response.json()
+            
+            # The body goes up as raw bytes, not as base64 inside JSON
+            response = await client.put(
+                upload["upload_url"],
+                content=image_bytes,
+                headers={"Content-Type": "image/jpeg"}
+            )
+            response.raise_for_status()
+            return upload["file_url"]
+    
+    async def _image_reference(self, client: httpx.AsyncClient, image_path: str) -> str:
+        """Return a URL for an image, uploading it once per content hash
+        
+        Falls back to an inline data URI when uploads are disabled or fail.
+        """
+        if not self.upload_references:
+            return self._encode_image_to_base64(image_path)
+        
+        digest = hashlib.sha256(Path(image_path).read_bytes()).hexdigest()
+        if digest in self._uploaded:
+            self._uploaded.move_to_end(digest)
+            return self._uploaded[digest]
+        
+        # Another worker may already have uploaded the same image
+        file_url = self.state.cache_get(f"fal_upload:{digest}")
+        if file_url:
+            self._remember_upload(digest, file_url)
+            return file_url
+        
+        try:
+            with span("fal.encode"):
+                image_bytes = encode_jpeg(image_path, max_size=1024, quality=90)
+            file_url = await self._upload_image(client, image_bytes, f"{digest[:16]}.jpg")
+        except Exception as e:
+            print(f"⚠️ Reference upload failed, sending inline image: {e}")
+            return self._encode_image_to_base64(image_path)
+        
+        self.state.cache_set(f"fal_upload:{digest}", file_url, ttl=settings.fal_upload_ttl)
+        self._remember_upload(digest, file_url)
+        return file_url
+    
+    def _remember_upload(self, digest: str, file_url: str) -> None:
+        """Keep an uploaded URL in the bounded per-process cache"""
+        self._uploaded[digest] = file_url
+        while len(self._uploaded) > settings.fal_upload_cache_size:
+            self._uploaded.popitem(last=False)
+    
+    def _forget_upload(self, file_url: str) -> None:
+        """Drop a stored URL Fal no longer accepts from both caches"""
+        for digest in [d for d, url in self._uploaded.items() if url == file_url]:
+            del self._uploaded[digest]
+            self.state.cache_delete(f"fal_upload:{digest}")
+    
+    async def _reference_alive(self, client: httpx.AsyncClient, file_url: str) -> bool:
+        """Whether a stored upload URL still resolves; unknown counts as alive"""
+        try:
+            with span("fal.check_reference"):
+                response = await client.head(file_url)
+        except httpx.HTTPError:
+            return True
+        return response.status_code < 400
+    
+    async def _post_with_references(
+        self,
+        client: httpx.AsyncClient,
+        endpoint: str,
+        payload: Dict[str, Any],
+        image_paths: Dict[str, str]
+    ) -> httpx.Response:
+        """POST payload with a reference for each image in image_paths
+        
+        A cached storage URL can expire or be deleted upstream. If Fal rejects
+        the request while it carries stored URLs, those that no longer resolve
+        are forgotten and their images uploaded again for one retry.
+        """
+        for attempt in range(2):
+            references = {
+                field: await self._image_reference(client, path) for field, path in image_paths.items()
+            }
+            with span("fal.request", endpoint=endpoint, attempt=attempt) as request_span:
+                response = await client.post(
+                    f"{self.base_url}/{endpoint}",
+                    headers=self._get_headers(),
+                    json={**payload, **references}
+                )
+                request_span.set(status_code=response.status_code)
+            
+            stored = [ref for ref in references.values() if not ref.startswith("data:")]
+            rejected = 400 <= response.status_code < 500 and response.status_code not in (401, 403, 429)
+            if attempt or not (rejected and stored):
+                return response
+            
+            # A 4xx about another field (e.g. width) must not evict uploads every worker shares
+            stale = [file_url for file_url in stored if not await self._reference_alive(client, file_url)]
+            if not stale:
+                return response
+            
+            print(f"⚠️ Fal rejected stale references ({response.status_code}), uploading again")
+            for file_url in stale:
+                self._forget_upload(file_url)
+        return response
+    
     async def generate_story_images(
         self,
         face_image_path: str,
@@ -55,7 +182,8 @@ class FalAIService:
         guidance_scale: float = 7.5,
         num_inference_steps: int = 25,
         width: int = 1024,
-        height: int = 1024
+        height: int = 1024,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Generate story images using Fal AI
@@ -63,42 +191,32 @@ class FalAIService:
         try:
             print(f"🎨 Starting Fal AI generation for {num_images} images...")
             
-            # Encode face image
-            face_image_b64 = self._encode_image_to_base64(face_image_path)
-            
-            # Encode mask image if provided
-            mask_image_b64 = None
-            if mask_image_path:
-                mask_image_b64 = self._encode_image_to_base64(mask_image_path)
-            
-            # Prepare the payload for Fal AI
-            payload = {
-                "prompt": f"professional portrait, {prompt}",
-                "negative_prompt": negative_prompt,
-                "image": face_image_b64,
-                "guidance_scale": guidance_scale,
-                "num_inference_steps": num_inference_steps,
-                "width": width,
-                "height": height,
-                "num_images": num_images,
-                "safety_checker": True,
-                "enhance_face": True
-            }
-            
-            # Add mask if provided
-            if mask_image_b64:
-                payload["mask_image"] = mask_image_b64
-                payload["strength"] = 0.8
-            
-            print(f"📡 Sending request to Fal AI...")
-            
-            # Make the API request
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/flux/schnell",
-                    headers=self._get_headers(),
-                    json=payload
-                )
+            async with self._client() as client:
+                # Reference images are uploaded once and sent by URL
+                image_paths = {"image": face_image_path}
+                
+                # Prepare the payload for Fal AI
+                payload = {
+                    "prompt": f"professional portrait, {prompt}",
+                    "negative_prompt": negative_prompt,
+                    "guidance_scale": guidance_scale,
+                    "num_inference_steps": num_inference_steps,
+                    "width": width,
+                    "height": height,
+                    "num_images": num_images,
+                    "safety_checker": True,
+                    "enhance_face": True
+                }
+                
+                # Add mask if provided
+                if mask_image_path:
+                    image_paths["mask_image"] = mask_image_path
+                    payload["strength"] = 0.8
+                
+                print(f"📡 Sending request to Fal AI...")
+                
+                # Make the API request
+                response = await self._post_with_references(client, "flux/schnell", payload, image_paths)
                 
                 if response.status_code != 200:
                     error_detail = response.text
@@ -111,9 +229,15 @@ class FalAIService:
                 result = response.json()
                 print(f"✅ Fal AI generation completed successfully!")
                 
+                # Fal returns image objects; callers work with plain URLs
+                images = [
+                    image["url"] if isinstance(image, dict) else image
+                    for image in result.get("images", [])
+                ]
+                
                 return {
                     "success": True,
-                    "images": result.get("images", []),
+                    "images": images,
                     "generation_time": result.get("timings", {}).get("inference", 0),
                     "model_used": "fal-ai/flux/schnell",
                     "parameters": {
@@ -125,6 +249,8 @@ class FalAIService:
                 }
                 
         except httpx.TimeoutException:
+            # Out of request budget rather than a slow upstream: surface as a cancellation
+            check_deadline()
             return {
                 "success": False,
                 "error": "Generation timeout. Please try again with fewer images or simpler prompts."
@@ -143,20 +269,11 @@ class FalAIService:
     ) -> Dict[str, Any]:
         """Generate image with face swap using Fal AI"""
         try:
-            face_image_b64 = self._encode_image_to_base64(face_image_path)
-            target_image_b64 = self._encode_image_to_base64(target_image_path)
-            
-            payload = {
-                "source_image": face_image_b64,
-                "target_image": target_image_b64
-            }
-            
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/face-swap",
-                    headers=self._get_headers(),
-                    json=payload
-                )
+            async with self._client() as client:
+                response = await self._post_with_references(client, "face-swap", {}, {
+                    "source_image": face_image_path,
+                    "target_image": target_image_path
+                })
                 
                 if response.status_code != 200:
                     return {
@@ -165,9 +282,10 @@ class FalAIService:
                     }
                 
                 result = response.json()
+                image = result.get("image")
                 return {
                     "success": True,
-                    "image": result.get("image"),
+                    "image": image["url"] if isinstance(image, dict) else image,
                     "model_used": "fal-ai/face-swap"
                 }
                 
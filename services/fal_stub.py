@@ -0,0 +1,76 @@
+import json
+import uuid
+from typing import Dict, List
+import httpx
+
+STUB_HOST = "https://fal-stub.local"
+
+class FalStub:
+    """In-process stand-in for the Fal storage and generation endpoints
+
+    Pass stub.transport to FalAIService(transport=...) to exercise the
+    upload/reference protocol without network access. Every request's body
+    size is recorded so transports can be compared.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self.request_bytes: List[int] = []
+        self.requests: List[str] = []
+        self.transport = httpx.MockTransport(self.handle)
+
+    def reset_counters(self) -> None:
+        """Forget recorded requests, keeping uploaded files"""
+        self.request_bytes.clear()
+        self.requests.clear()
+
+    def _resolve(self, reference: str) -> bool:
+        """Whether an image reference is an inline data URI or a known upload"""
+        return reference.startswith("data:image/") or reference in self.files
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        self.request_bytes.append(len(body))
+        self.requests.append(f"{request.method} {request.url.path}")
+        path = request.url.path
+
+        if request.method == "POST" and path.endswith("/storage/upload/initiate"):
+            file_id = uuid.uuid4().hex
+            return httpx.Response(200, json={
+                "upload_url": f"{STUB_HOST}/upload/{file_id}",
+                "file_url": f"{STUB_HOST}/files/{file_id}.jpg"
+            })
+
+        if request.method == "PUT" and path.startswith("/upload/"):
+            file_id = path.rsplit("/", 1)[-1]
+            self.files[f"{STUB_HOST}/files/{file_id}.jpg"] = body
+            return httpx.Response(200)
+
+        if request.method in ("GET", "HEAD") and path.startswith("/files/"):
+            content = self.files.get(str(request.url))
+            if content is None:
+                return httpx.Response(404)
+            if request.method == "HEAD":
+                return httpx.Response(200, headers={"Content-Type": "image/jpeg", "Content-Length": str(len(content))})
+            return httpx.Response(200, content=content, headers={"Content-Type": "image/jpeg"})
+
+        if request.method == "POST" and path.endswith("/flux/schnell"):
+            payload = json.loads(body)
+            references = [payload["image"]] + ([payload["mask_image"]] if "mask_image" in payload else [])
+            if not all(self._resolve(ref) for ref in references):
+                return httpx.Response(422, text="Unknown image reference")
+            if not 0 < payload.get("width", 1024) <= 2048 or not 0 < payload.get("height", 1024) <= 2048:
+                return httpx.Response(422, text="width and height must be between 1 and 2048")
+            source = payload["image"] if payload["image"] in self.files else None
+            return httpx.Response(200, json={
+                "images": [{"url": source or f"{STUB_HOST}/files/missing.jpg"}] * payload.get("num_images", 1),
+                "timings": {"inference": 0.0}
+            })
+
+        if request.method == "POST" and path.endswith("/face-swap"):
+            payload = json.loads(body)
+            if not (self._resolve(payload["source_image"]) and self._resolve(payload["target_image"])):
+                return httpx.Response(422, text="Unknown image reference")
+            return httpx.Response(200, json={"image": {"url": payload["target_image"]}})
+
+        return httpx.Response(404, text=f"No stub route for {request.method} {path}")
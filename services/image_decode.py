@@ -0,0 +1,96 @@
+import io
+from typing import Optional
+from PIL import Image
+from config.settings import settings
+
+try:
+    import numpy as np
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# cv2 flags that decode JPEGs directly at 1/2, 1/4 or 1/8 scale
+_CV2_REDUCED_FLAGS = {}
+if CV2_AVAILABLE:
+    _CV2_REDUCED_FLAGS = {
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+    }
+
+def open_reduced(image_path: str, max_size: Optional[int] = None) -> Image.Image:
+    """Open an image as RGB with its longest side at most max_size
+
+    JPEGs are decoded straight at the nearest DCT scale (draft mode), so a
+    large upload never materialises at native resolution.
+    """
+    max_size = max_size or settings.decode_max_size
+    img = Image.open(image_path)
+
+    # draft() must run before anything touches the pixels
+    if img.format == "JPEG":
+        img.draft("RGB", (max_size, max_size))
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return img
+
+def encode_jpeg(image_path: str, max_size: Optional[int] = None, quality: int = 90) -> bytes:
+    """Decode at reduced scale and re-encode as JPEG bytes"""
+    with open_reduced(image_path, max_size) as img:
+        buffered = io.BytesIO()
+        img.save(buffered, format="JPEG", quality=quality)
+        return buffered.getvalue()
+
+def _reduction_factor(image_path: str, max_size: int) -> int:
+    """Largest cv2 reduction (1, 2, 4, 8) that keeps the image at least max_size"""
+    with Image.open(image_path) as img:
+        # Only JPEG supports true reduce-on-decode; other formats decode fully anyway
+        if img.format != "JPEG":
+            return 1
+        longest = max(img.size)
+
+    for factor in (8, 4, 2):
+        if longest // factor >= max_size:
+            return factor
+    return 1
+
+def decode_bgr(image_path: str, max_size: Optional[int] = None) -> "np.ndarray":
+    """Decode an image into a single C-contiguous BGR array for cv2/insightface
+
+    The reduced-scale decode writes straight into the returned buffer; only a
+    final resize allocates again, and only when the image is still too large.
+    """
+    max_size = max_size or settings.decode_max_size
+    factor = _reduction_factor(image_path, max_size)
+    flag = _CV2_REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR)
+
+    array = cv2.imread(image_path, flag)
+    if array is None:
+        # Formats cv2 cannot read: decode with PIL and swap channels in place
+        array = np.array(open_reduced(image_path, max_size))
+        cv2.cvtColor(array, cv2.COLOR_RGB2BGR, dst=array)
+        return array
+
+    height, width = array.shape[:2]
+    if max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        array = cv2.resize(
+            array,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+    return array
+
+def bgr_to_pil(array: "np.ndarray") -> Image.Image:
+    """Convert a BGR array to RGB in place and wrap it as a PIL image without copying
+
+    The array must not be used as BGR afterwards.
+    """
+    cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array)
+    height, width = array.shape[:2]
+    return Image.frombuffer("RGB", (width, height), array, "raw", "RGB", 0, 1)
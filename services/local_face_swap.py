@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from config.settings import settings
+from services.face_analysis import get_face_analysis
+from services.image_decode import decode_bgr
+
+try:
+    import cv2
+    import insightface
+    LOCAL_FACE_SWAP_AVAILABLE = True
+except ImportError as e:
+    print(f"Warning: local face swap not available: {e}")
+    LOCAL_FACE_SWAP_AVAILABLE = False
+
+# Runs anywhere: ONNX Runtime's CPU provider needs no GPU drivers
+PROVIDERS = ['CPUExecutionProvider']
+
+def _largest_face(faces):
+    return max(faces, key=lambda x: (x['bbox'][2] - x['bbox'][0]) * (x['bbox'][3] - x['bbox'][1]))
+
+class LocalFaceSwapService:
+    """Face swap with a resident insightface detector and inswapper model
+
+    Source faces are cached by image hash, so swapping one face into many
+    targets analyses the source once.
+    """
+
+    name = "local"
+
+    def __init__(self, model_path: Optional[str] = None, cache_size: Optional[int] = None):
+        self.model_path = model_path or settings.face_swap_model
+        self.cache_size = cache_size or settings.face_swap_cache_size
+        self._analyser = None
+        self._swapper = None
+        self._source_faces: "OrderedDict[str, Any]" = OrderedDict()
+        # insightface models are not safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        """Load the detector and swapper once and keep them resident"""
+        if self._swapper is not None:
+            return
+        if not LOCAL_FACE_SWAP_AVAILABLE:
+            raise ValueError("Local face swap requires insightface, onnxruntime and opencv-python")
+        if not Path(self.model_path).exists():
+            raise ValueError(f"Face swap model not found at {self.model_path}. Run scripts/install_models.py")
+
+        print("🤖 Loading local face swap models...")
+        # The detector is shared with the StoryMaker pipeline rather than loaded twice
+        self._analyser = get_face_analysis()
+        self._swapper = insightface.model_zoo.get_model(self.model_path, providers=PROVIDERS)
+
+    def _source_face(self, image_path: str):
+        """Detected source face for an image, cached by content hash"""
+        digest = hashlib.sha256(Path(image_path).read_bytes()).hexdigest()
+        if digest in self._source_faces:
+            self._source_faces.move_to_end(digest)
+            return self._source_faces[digest]
+
+        faces = self._analyser.get(decode_bgr(image_path))
+        if not faces:
+            raise ValueError("No face detected in the source image")
+
+        face = _largest_face(faces)
+        self._source_faces[digest] = face
+        while len(self._source_faces) > self.cache_size:
+            self._source_faces.popitem(last=False)
+        return face
+
+    def swap_batch_sync(self, face_image_path: str, target_image_paths: List[str], session_id: str) -> Dict[str, Any]:
+        """Swap one source face into every target image (blocking)"""
+        start_time = time.perf_counter()
+        with self._lock:
+            self._load()
+            source_face = self._source_face(face_image_path)
+
+            images: List[Optional[str]] = []
+            errors: Dict[int, str] = {}
+            for i, target_path in enumerate(target_image_paths):
+                try:
+                    target = decode_bgr(target_path, settings.face_swap_max_size)
+                    faces = self._analyser.get(target)
+                    if not faces:
+                        images.append(None)
+                        errors[i] = "No face detected in the target image"
+                        continue
+
+                    swapped = self._swapper.get(target, _largest_face(faces), source_face, paste_back=True)
+                    output_path = f"static/results/faceswap_{session_id}_{i}.jpg"
+                    cv2.imwrite(output_path, swapped)
+                    images.append(f"/{output_path}")
+                except Exception as e:
+                    # One bad target fails alone, as it does on the Fal path
+                    images.append(None)
+                    errors[i] = f"Face swap failed: {str(e)}"
+
+        return {
+            "success": any(images),
+            "images": images,
+            "errors": errors,
+            "generation_time": time.perf_counter() - start_time,
+            "model_used": f"insightface/{Path(self.model_path).name}"
+        }
+
+    async def swap_batch(
+        self,
+        face_image_path: str,
+        target_image_paths: List[str],
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Swap one source face into many targets in a worker thread"""
+        try:
+            return await asyncio.to_thread(
+                self.swap_batch_sync, face_image_path, target_image_paths, session_id or str(uuid.uuid4())
+            )
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Face swap failed: {str(e)}"
+            }
+
+    async def generate_with_face_swap(
+        self,
+        face_image_path: str,
+        target_image_path: str
+    ) -> Dict[str, Any]:
+        """Single swap with the same interface as FalAIService"""
+        result = await self.swap_batch(face_image_path, [target_image_path])
+        if not result["success"]:
+            return {
+                "success": False,
+                "error": result.get("error") or result["errors"].get(0, "Face swap failed")
+            }
+        return {
+            "success": True,
+            "image": result["images"][0],
+            "model_used": result["model_used"]
+        }
+
+# Global service instance
+local_face_swap_service = LocalFaceSwapService()
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+from typing import AsyncIterator, Dict, Any, Optional
+from services.backends import BackendCapabilities, stream_from_thread
+
+class LocalPipelineService:
+    """Runs the resident StoryMaker pipeline on local CPU/GPU capacity"""
+
+    name = "local"
+    capabilities = BackendCapabilities(supports_masks=True, supports_streaming=True)
+
+    def __init__(self):
+        # The pipeline holds a single model copy, so requests run one at a time.
+        # A cancelled request releases this lock before its thread stops;
+        # pipeline_runner's own lock keeps the two pipe() calls apart.
+        self._lock = asyncio.Lock()
+
+    async def generate_story_images(
+        self,
+        face_image_path: str,
+        prompt: str,
+        negative_prompt: str = "",
+        mask_image_path: Optional[str] = None,
+        num_images: int = 4,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 25,
+        width: int = 1024,
+        height: int = 1024,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Generate story images with the local pipeline in a worker thread"""
+        import pipeline_runner
+
+        async with self._lock:
+            return await asyncio.to_thread(
+                pipeline_runner.run_generation,
+                face_image_path,
+                mask_image_path,
+                prompt,
+                negative_prompt,
+                session_id or str(uuid.uuid4()),
+                num_images=num_images,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                width=width,
+                height=height
+            )
+
+    async def stream_story_images(
+        self,
+        face_image_path: str,
+        prompt: str,
+        negative_prompt: str = "",
+        mask_image_path: Optional[str] = None,
+        num_images: int = 4,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 25,
+        width: int = 1024,
+        height: int = 1024,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield an image event after each pipe() output is saved, then the full result"""
+        import pipeline_runner
+
+        session_id = session_id or str(uuid.uuid4())
+        async with self._lock:
+            async for event in stream_from_thread(
+                lambda on_image_saved: pipeline_runner.run_generation(
+                    face_image_path,
+                    mask_image_path,
+                    prompt,
+                    negative_prompt,
+                    session_id,
+                    num_images=num_images,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    width=width,
+                    height=height,
+                    on_image_saved=on_image_saved
+                )
+            ):
+                yield event
+
+# Global service instance
+local_pipeline_service = LocalPipelineService()
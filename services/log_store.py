@@ -0,0 +1,313 @@
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from config.settings import settings
+
+LOG_PATTERN = re.compile(r"generation_(\d{8})\.json$")
+PARTITION_PATTERN = re.compile(r"generation_(\d{8})\.npz$")
+
+# Last status a session reached; "started" means no terminal event was logged
+STATUSES = ["started", "completed", "failed", "error", "cancelled"]
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+
+NUMERIC_COLUMNS = {
+    "timestamp": np.float64,
+    "num_images": np.int16,
+    "num_inference_steps": np.int16,
+    "guidance_scale": np.float32,
+    "num_generated": np.int16,
+    "generation_time": np.float32,
+    "streamed": np.bool_,
+}
+# Request parameters, known only from a session's "started" event
+PARAMETER_COLUMNS = ["num_images", "num_inference_steps", "guidance_scale"]
+GROUP_COLUMNS = ["num_images", "num_inference_steps", "guidance_scale", "status", "streamed", "error_type"]
+
+def error_type(message: Optional[str]) -> str:
+    """Collapse an error message to its kind, e.g. "API error: 502" or "Generation timeout"
+
+    Free-form details (exception text, response bodies) are dropped so that
+    failures group by cause rather than by message.
+    """
+    if not message:
+        return ""
+    head, sep, rest = message.partition(":")
+    if sep:
+        code = re.match(r"\s*(\d{3})\b", rest)
+        return f"{head}: {code.group(1)}" if code else head
+    return message.split(".")[0][:80]
+
+def _empty_row(session_id: str) -> Dict[str, Any]:
+    return {
+        "session_id": session_id,
+        "timestamp": np.nan,
+        "status": "started",
+        "num_images": -1,
+        "num_inference_steps": -1,
+        "guidance_scale": np.nan,
+        "num_generated": 0,
+        "generation_time": np.nan,
+        "streamed": False,
+        "error_type": "",
+    }
+
+def _read_entries(log_file: Path) -> Iterable[Dict[str, Any]]:
+    with open(log_file, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def _fold(row: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    """Apply one log entry to its session's row"""
+    details = entry.get("details") or {}
+    if np.isnan(row["timestamp"]):
+        row["timestamp"] = datetime.fromisoformat(entry["timestamp"]).timestamp()
+
+    status = entry.get("status")
+    if status == "started":
+        for key in PARAMETER_COLUMNS:
+            if details.get(key) is not None:
+                row[key] = details[key]
+        return
+    if status not in STATUS_CODES:
+        return
+    row["status"] = status
+    if status == "completed":
+        row["num_generated"] = details.get("num_generated", 0)
+        row["generation_time"] = details.get("generation_time", np.nan)
+        row["streamed"] = bool(details.get("streamed", False))
+    elif status == "cancelled":
+        row["error_type"] = details.get("reason", "cancelled")
+    else:
+        row["error_type"] = error_type(details.get("error"))
+
+def read_sessions(
+    log_file: Path,
+    previous_file: Optional[Path] = None,
+    next_file: Optional[Path] = None
+) -> List[Dict[str, Any]]:
+    """Fold one day's JSONL log into one row per session
+
+    A session belongs to the day it started on. Given the neighbouring
+    days' logs, a session that runs past midnight takes its terminal event
+    from next_file, and events here for sessions started in previous_file
+    are left to that day's row.
+    """
+    sessions: Dict[str, Dict[str, Any]] = {}
+    started_here = set()
+    for entry in _read_entries(log_file):
+        session_id = entry["session_id"]
+        if entry.get("status") == "started":
+            started_here.add(session_id)
+        _fold(sessions.setdefault(session_id, _empty_row(session_id)), entry)
+
+    if next_file is not None and next_file.exists():
+        for entry in _read_entries(next_file):
+            if entry["session_id"] in started_here and entry.get("status") != "started":
+                _fold(sessions[entry["session_id"]], entry)
+
+    if previous_file is not None and previous_file.exists():
+        carried_over = set(sessions) - started_here
+        for entry in _read_entries(previous_file):
+            if entry["session_id"] in carried_over and entry.get("status") == "started":
+                del sessions[entry["session_id"]]
+                carried_over.discard(entry["session_id"])
+    return list(sessions.values())
+
+def _to_columns(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Build the partition columns; strings with few distinct values are dictionary-encoded"""
+    columns = {
+        name: np.array([row[name] for row in rows], dtype=dtype)
+        for name, dtype in NUMERIC_COLUMNS.items()
+    }
+    columns["session_id"] = np.array([row["session_id"] for row in rows], dtype=str)
+    columns["status"] = np.array([STATUS_CODES[row["status"]] for row in rows], dtype=np.int8)
+    vocabulary, codes = np.unique(np.array([row["error_type"] for row in rows], dtype=str), return_inverse=True)
+    columns["error_vocab"] = vocabulary
+    columns["error_code"] = codes.astype(np.int32)
+    return columns
+
+def _neighbour(log_file: Path, days: int) -> Path:
+    """The log file for the day before (-1) or after (+1) log_file"""
+    day = datetime.strptime(LOG_PATTERN.search(log_file.name).group(1), "%Y%m%d").date()
+    return log_file.with_name(f"generation_{(day + timedelta(days=days)).strftime('%Y%m%d')}.json")
+
+def compact_file(log_file: Path, store_dir: Optional[Path] = None) -> Path:
+    """Write one day's log as a columnar partition and return its path"""
+    store_dir = Path(store_dir or settings.log_store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    day = LOG_PATTERN.search(log_file.name).group(1)
+    partition = store_dir / f"generation_{day}.npz"
+
+    rows = read_sessions(log_file, _neighbour(log_file, -1), _neighbour(log_file, 1))
+    tmp_path = partition.with_name(f".{partition.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **_to_columns(rows))
+    os.replace(tmp_path, partition)
+    return partition
+
+def compact(
+    log_dir: Path = Path("logs"),
+    store_dir: Optional[Path] = None,
+    include_today: bool = False,
+    force: bool = False
+) -> List[Path]:
+    """Compact closed daily logs that have no up-to-date partition yet
+
+    Today's file is still being appended to, so it is skipped unless
+    include_today is set; compacting it again later simply replaces it.
+    A partition is also rebuilt when the next day's log has changed, since
+    that log may finish sessions started before midnight.
+    """
+    store_dir = Path(store_dir or settings.log_store_dir)
+    today = date.today().strftime("%Y%m%d")
+    written = []
+    for log_file in sorted(Path(log_dir).glob("generation_*.json")):
+        match = LOG_PATTERN.search(log_file.name)
+        if not match or (match.group(1) >= today and not include_today):
+            continue
+        partition = store_dir / f"generation_{match.group(1)}.npz"
+        next_file = _neighbour(log_file, 1)
+        sources = [log_file] + ([next_file] if next_file.exists() else [])
+        if not force and partition.exists() and all(
+            partition.stat().st_mtime >= source.stat().st_mtime for source in sources
+        ):
+            continue
+        written.append(compact_file(log_file, store_dir))
+    return written
+
+class LogTable:
+    """Generation sessions as NumPy columns, with error types dictionary-encoded"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], error_vocab: np.ndarray):
+        self.columns = columns
+        self.error_vocab = error_vocab
+
+    def __len__(self) -> int:
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def labels(self, name: str, values: np.ndarray) -> List[Any]:
+        """Readable labels for values of a column"""
+        if name == "status":
+            return [STATUSES[value] for value in values]
+        if name == "error_type":
+            return [self.error_vocab[value] or "none" for value in values]
+        return values.tolist()
+
+    @classmethod
+    def concat(cls, partitions: Sequence[Dict[str, np.ndarray]]) -> "LogTable":
+        """Merge partitions, remapping each one's error codes onto a shared vocabulary"""
+        if not partitions:
+            empty = _to_columns([])
+            vocabulary = empty.pop("error_vocab")
+            empty["error_type"] = empty.pop("error_code")
+            return cls(empty, vocabulary)
+
+        vocabulary = np.unique(np.concatenate([part["error_vocab"] for part in partitions]))
+        columns = {
+            name: np.concatenate([part[name] for part in partitions])
+            for name in list(NUMERIC_COLUMNS) + ["session_id", "status"]
+        }
+        columns["error_type"] = np.concatenate([
+            np.searchsorted(vocabulary, part["error_vocab"]).astype(np.int32)[part["error_code"]]
+            for part in partitions
+        ])
+        return cls(columns, vocabulary)
+
+def load(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    store_dir: Optional[Path] = None
+) -> LogTable:
+    """Load the partitions for days in [since, until]"""
+    store_dir = Path(store_dir or settings.log_store_dir)
+    low = since.strftime("%Y%m%d") if since else ""
+    high = until.strftime("%Y%m%d") if until else "99999999"
+    partitions = []
+    for path in sorted(store_dir.glob("generation_*.npz")):
+        match = PARTITION_PATTERN.search(path.name)
+        if match and low <= match.group(1) <= high:
+            with np.load(path, allow_pickle=False) as data:
+                partitions.append({name: data[name] for name in data.files})
+    return LogTable.concat(partitions)
+
+def latency_percentiles(
+    table: LogTable,
+    by: str = "num_images",
+    percentiles: Iterable[float] = (50, 95, 99)
+) -> List[Dict[str, Any]]:
+    """generation_time percentiles of completed sessions, grouped by a column"""
+    if by not in GROUP_COLUMNS:
+        raise ValueError(f"Cannot group by {by}; choose one of {', '.join(GROUP_COLUMNS)}")
+    percentiles = list(percentiles)
+    times = table["generation_time"]
+    mask = (table["status"] == STATUS_CODES["completed"]) & np.isfinite(times)
+    if by in PARAMETER_COLUMNS:
+        # Sessions whose start was not logged have no parameters to group by
+        mask &= table[by] >= 0
+    keys, times = table[by][mask], times[mask]
+    if not len(keys):
+        return []
+
+    order = np.argsort(keys, kind="stable")
+    keys, times = keys[order], times[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    groups = np.split(times, starts[1:])
+    labels = table.labels(by, keys[starts])
+
+    rows = []
+    for label, group in zip(labels, groups):
+        values = np.percentile(group, percentiles)
+        row = {by: label, "count": len(group), "mean": float(group.mean())}
+        row.update({f"p{p:g}": float(v) for p, v in zip(percentiles, values)})
+        rows.append(row)
+    return rows
+
+def failure_rates(table: LogTable) -> List[Dict[str, Any]]:
+    """Share of finished sessions that ended in each error type, most frequent first"""
+    status = table["status"]
+    finished = status != STATUS_CODES["started"]
+    total = int(finished.sum())
+    failed = finished & (status != STATUS_CODES["completed"])
+    counts = np.bincount(table["error_type"][failed], minlength=len(table.error_vocab))
+
+    rows = []
+    for code in np.argsort(-counts, kind="stable"):
+        if counts[code] == 0:
+            break
+        rows.append({
+            "error_type": table.labels("error_type", [code])[0],
+            "count": int(counts[code]),
+            "rate": counts[code] / total
+        })
+    return rows
+
+def throughput_per_hour(table: LogTable) -> List[Dict[str, Any]]:
+    """Sessions, completions and images generated per wall-clock hour"""
+    if not len(table):
+        return []
+    hours = np.floor(table["timestamp"] / 3600).astype(np.int64)
+    buckets, inverse = np.unique(hours, return_inverse=True)
+    completed = table["status"] == STATUS_CODES["completed"]
+    sessions = np.bincount(inverse, minlength=len(buckets))
+    completions = np.bincount(inverse, weights=completed, minlength=len(buckets))
+    images = np.bincount(inverse, weights=np.where(completed, table["num_generated"], 0), minlength=len(buckets))
+
+    return [
+        {
+            "hour": datetime.fromtimestamp(int(bucket) * 3600).strftime("%Y-%m-%d %H:00"),
+            "sessions": int(count),
+            "completed": int(done),
+            "images": int(generated)
+        }
+        for bucket, count, done, generated in zip(buckets, sessions, completions, images)
+    ]
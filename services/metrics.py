@@ -0,0 +1,19 @@
+from typing import Dict
+from services.shared_state import SharedState, shared_state
+
+class Metrics:
+    """Counters reported by /stats, shared by every worker process"""
+
+    def __init__(self, state: SharedState):
+        self.state = state
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        """Increase a counter and return its new value"""
+        return self.state.incr(name, amount)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Current value of every counter"""
+        return self.state.counters()
+
+# Global metrics instance
+metrics = Metrics(shared_state)
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from config.settings import settings
+
+# Cost is measured in image-steps-megapixels: one 1024x1024 image at 25 steps is ~26
+COST_CLASSES: List[Tuple[str, float]] = [
+    ("small", 30.0),
+    ("medium", 150.0),
+    ("large", float("inf")),
+]
+
+def estimate_cost(num_images: int, num_inference_steps: int, width: int, height: int) -> float:
+    """Estimated compute of a /generate request: images x steps x megapixels"""
+    return max(1, num_images) * max(1, num_inference_steps) * (width * height) / 1_000_000
+
+def cost_class(cost: float) -> str:
+    """Bucket a cost estimate for reporting"""
+    for name, upper in COST_CLASSES:
+        if cost <= upper:
+            return name
+    return COST_CLASSES[-1][0]
+
+class CostModel:
+    """Learned seconds-per-cost-unit for each backend (exponentially weighted)"""
+
+    def __init__(self, prior: float, alpha: float = 0.2):
+        self.prior = prior
+        self.alpha = alpha
+        self._rates: Dict[str, float] = {}
+
+    def expected_seconds(self, backend: str, cost: float) -> float:
+        return self._rates.get(backend, self.prior) * cost
+
+    def observe(self, backend: str, cost: float, seconds: float) -> None:
+        rate = seconds / max(cost, 1e-6)
+        current = self._rates.get(backend)
+        self._rates[backend] = rate if current is None else (1 - self.alpha) * current + self.alpha * rate
+
+    def rates(self) -> Dict[str, float]:
+        return dict(self._rates)
+
+class QueueTimeout(Exception):
+    """Raised when a request is not admitted before its timeout"""
+
+class Ticket:
+    """A request waiting for, or holding, a generation slot"""
+
+    def __init__(self, client_id: str, cost: float, backend: str, expected: float, finish_tag: float):
+        self.client_id = client_id
+        self.cost = cost
+        self.cost_class = cost_class(cost)
+        # Estimates are made under the requested backend; the router may
+        # reassign backend to the one that served, so both rates are learned
+        self.requested_backend = backend
+        self.backend = backend
+        self.expected = expected
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        # Set by the caller; only successful runs teach the cost model, since
+        # a request rejected in milliseconds says nothing about its cost
+        self.succeeded = False
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class CostAwareScheduler:
+    """Admits generation requests into a fixed number of slots
+
+    Waiting requests are ordered by weighted fair queuing across clients:
+    each gets a finish tag of max(virtual time, client's last tag) plus its
+    expected seconds divided by the client weight. Requests expected to
+    finish within the interactive threshold are served before batch work,
+    and since tags grow with expected time, shorter jobs go first within
+    fairness. Batch requests waiting longer than max_wait are promoted so
+    they cannot starve.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        interactive_seconds: Optional[float] = None,
+        max_wait: Optional[float] = None,
+        cost_prior: Optional[float] = None,
+        window: int = 500
+    ):
+        self.max_concurrent = max_concurrent or settings.scheduler_max_concurrent
+        self.interactive_seconds = (
+            interactive_seconds if interactive_seconds is not None else settings.scheduler_interactive_seconds
+        )
+        self.max_wait = max_wait if max_wait is not None else settings.scheduler_max_wait
+        self.cost_model = CostModel(cost_prior or settings.scheduler_cost_prior)
+        self._running = 0
+        self._waiting: List[Ticket] = []
+        self._virtual_time = 0.0
+        self._client_tags: Dict[str, float] = {}
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {
+            name: deque(maxlen=window) for name, _ in COST_CLASSES
+        }
+
+    def _priority(self, ticket: Ticket, now: float) -> Tuple[int, float]:
+        interactive = ticket.expected <= self.interactive_seconds
+        aged = now - ticket.enqueued_at >= self.max_wait
+        return (0 if interactive or aged else 1, ticket.finish_tag)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the best waiting tickets"""
+        now = time.monotonic()
+        while self._running < self.max_concurrent and self._waiting:
+            ticket = min(self._waiting, key=lambda t: self._priority(t, now))
+            self._waiting.remove(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.finish_tag)
+            self._running += 1
+            ticket.granted.set_result(True)
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+        # A tag at or below virtual time no longer affects a client's next start tag
+        self._client_tags = {
+            client_id: tag for client_id, tag in self._client_tags.items() if tag > self._virtual_time
+        }
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        client_id: str,
+        cost: float,
+        backend: str,
+        weight: float = 1.0,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[Ticket]:
+        """Wait for a generation slot, hold it for the block, then learn from its timing
+
+        The timing is learned only if the caller marks ticket.succeeded.
+        Raises QueueTimeout if no slot is granted within timeout seconds.
+        """
+        expected = self.cost_model.expected_seconds(backend, cost)
+        start_tag = max(self._virtual_time, self._client_tags.get(client_id, 0.0))
+        finish_tag = start_tag + expected / max(weight, 1e-6)
+        self._client_tags[client_id] = finish_tag
+
+        ticket = Ticket(client_id, cost, backend, expected, finish_tag)
+        self._waiting.append(ticket)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.granted), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            if ticket.granted.done():
+                # Granted just as the waiter gave up: hand the slot on
+                self._release()
+            else:
+                ticket.granted.cancel()
+                self._waiting.remove(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                raise QueueTimeout(f"Not admitted within {timeout:.1f}s") from None
+            raise
+
+        ticket.started_at = time.monotonic()
+        completed = False
+        try:
+            yield ticket
+            completed = True
+        finally:
+            finished_at = time.monotonic()
+            service_time = finished_at - ticket.started_at
+            self._samples[ticket.cost_class].append((ticket.started_at - ticket.enqueued_at, service_time))
+            if completed and ticket.succeeded:
+                self.cost_model.observe(ticket.backend, ticket.cost, service_time)
+                if ticket.requested_backend != ticket.backend:
+                    self.cost_model.observe(ticket.requested_backend, ticket.cost, service_time)
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, learned cost rates and wait/service percentiles per cost class"""
+        def summary(values: List[float]) -> Dict[str, Optional[float]]:
+            if not values:
+                return {"p50": None, "p95": None}
+            ordered = sorted(values)
+            return {
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+            }
+
+        return {
+            "running": self._running,
+            "waiting": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "seconds_per_cost_unit": self.cost_model.rates(),
+            "cost_classes": {
+                name: {
+                    "requests": len(samples),
+                    "queue_wait": summary([wait for wait, _ in samples]),
+                    "service_time": summary([service for _, service in samples])
+                }
+                for name, samples in self._samples.items()
+            }
+        }
+
+# Global scheduler instance
+scheduler = CostAwareScheduler()
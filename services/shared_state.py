@@ -0,0 +1,320 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Optional
+from config.settings import settings
+
+# How often a SQLite worker deletes expired cache entries and stale records
+PRUNE_INTERVAL = 600
+
+class SharedState(ABC):
+    """State shared by every worker process: counters, a cache index and session records
+
+    Session records expire SHARED_STATE_RECORD_TTL seconds after their last
+    update.
+    """
+
+    @abstractmethod
+    def incr(self, name: str, amount: int = 1) -> int:
+        """Atomically add to a counter and return its new value"""
+
+    @abstractmethod
+    def init_counter(self, name: str, value: int) -> None:
+        """Set a counter only if no worker has created it yet"""
+
+    @abstractmethod
+    def counters(self) -> Dict[str, int]:
+        """Current value of every counter"""
+
+    @abstractmethod
+    def cache_get(self, key: str) -> Optional[str]:
+        """Look up a shared cache entry"""
+
+    @abstractmethod
+    def cache_set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Store a shared cache entry, optionally expiring after ttl seconds"""
+
+    @abstractmethod
+    def cache_add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Store a cache entry only if none exists; True if this call stored it"""
+
+    @abstractmethod
+    def cache_delete(self, key: str) -> None:
+        """Remove a shared cache entry"""
+
+    @abstractmethod
+    def _put_record(self, kind: str, record_id: str, record: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def _get_record(self, kind: str, record_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def prune(self) -> None:
+        """Delete expired entries; backends with native expiry need nothing"""
+
+    def put_session(self, session_id: str, record: Dict[str, Any]) -> None:
+        self._put_record("session", session_id, record)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._get_record("session", session_id)
+
+class SQLiteSharedState(SharedState):
+    """Shared state in a local SQLite database in WAL mode
+
+    Every worker on the host opens the same file; WAL lets readers proceed
+    while one writer commits.
+    """
+
+    def __init__(self, path: Optional[Path] = None, record_ttl: Optional[float] = None):
+        self.path = Path(path or settings.shared_state_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.record_ttl = record_ttl or settings.shared_state_record_ttl
+        self._local = threading.local()
+        self._last_prune = 0.0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL);
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, id)
+            );
+            CREATE INDEX IF NOT EXISTS records_updated_at ON records (updated_at);
+            CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit so each statement is its own transaction"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount)
+            )
+            value = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def init_counter(self, name: str, value: int) -> None:
+        self._conn().execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)", (name, value))
+
+    def counters(self) -> Dict[str, int]:
+        return dict(self._conn().execute("SELECT name, value FROM counters").fetchall())
+
+    def cache_get(self, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def cache_set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+
+    def cache_add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+            added = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def cache_delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _put_record(self, kind: str, record_id: str, record: Dict[str, Any]) -> None:
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO records (kind, id, data, updated_at) VALUES (?, ?, ?, ?)",
+            (kind, record_id, json.dumps(record), now)
+        )
+        # Writes drive cleanup, so an idle database is left alone
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self.prune()
+
+    def _get_record(self, kind: str, record_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM records WHERE kind = ? AND id = ? AND updated_at > ?",
+            (kind, record_id, time.time() - self.record_ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune(self) -> None:
+        now = time.time()
+        self._last_prune = now
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        conn.execute("DELETE FROM records WHERE updated_at <= ?", (now - self.record_ttl,))
+
+class RedisSharedState(SharedState):
+    """Shared state in Redis, for workers spread across hosts"""
+
+    def __init__(
+        self,
+        client: Any = None,
+        url: Optional[str] = None,
+        prefix: str = "storymaker:",
+        record_ttl: Optional[float] = None
+    ):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ValueError("SHARED_STATE_BACKEND=redis requires the redis package")
+            client = redis.Redis.from_url(url or settings.redis_url)
+        self.client = client
+        self.prefix = prefix
+        self.record_ttl = record_ttl or settings.shared_state_record_ttl
+
+    @staticmethod
+    def _text(value: Any) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        return int(self.client.hincrby(f"{self.prefix}counters", name, amount))
+
+    def init_counter(self, name: str, value: int) -> None:
+        self.client.hsetnx(f"{self.prefix}counters", name, value)
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            self._text(name): int(value)
+            for name, value in self.client.hgetall(f"{self.prefix}counters").items()
+        }
+
+    def cache_get(self, key: str) -> Optional[str]:
+        value = self.client.get(f"{self.prefix}cache:{key}")
+        return self._text(value) if value is not None else None
+
+    def cache_set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.client.set(f"{self.prefix}cache:{key}", value, ex=int(ttl) if ttl else None)
+
+    def cache_add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return bool(self.client.set(f"{self.prefix}cache:{key}", value, ex=int(ttl) if ttl else None, nx=True))
+
+    def cache_delete(self, key: str) -> None:
+        self.client.delete(f"{self.prefix}cache:{key}")
+
+    def _put_record(self, kind: str, record_id: str, record: Dict[str, Any]) -> None:
+        self.client.set(f"{self.prefix}{kind}:{record_id}", json.dumps(record), ex=int(self.record_ttl))
+
+    def _get_record(self, kind: str, record_id: str) -> Optional[Dict[str, Any]]:
+        value = self.client.get(f"{self.prefix}{kind}:{record_id}")
+        return json.loads(value) if value is not None else None
+
+class InMemoryRedis:
+    """Single-process stand-in for the subset of the redis client RedisSharedState uses
+
+    Backs SHARED_STATE_BACKEND=memory: one worker, no server, nothing persisted.
+    """
+
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, int]] = {}
+        self._values: Dict[str, Any] = {}
+        self._expiry: Dict[str, float] = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        with self._lock:
+            fields = self._hashes.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + amount
+            return fields[field]
+
+    def hsetnx(self, key: str, field: str, value: int) -> int:
+        with self._lock:
+            fields = self._hashes.setdefault(key, {})
+            if field in fields:
+                return 0
+            fields[field] = int(value)
+            return 1
+
+    def hgetall(self, key: str) -> Dict[bytes, bytes]:
+        with self._lock:
+            return {
+                field.encode(): str(value).encode()
+                for field, value in self._hashes.get(key, {}).items()
+            }
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            expires_at = self._expiry.get(key)
+            if expires_at is not None and expires_at <= time.time():
+                self._values.pop(key, None)
+                self._expiry.pop(key, None)
+            value = self._values.get(key)
+            return value.encode() if isinstance(value, str) else value
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        with self._lock:
+            if nx and key in self._values and self._expiry.get(key, float("inf")) > time.time():
+                return None
+            self._writes += 1
+            if self._writes % 1024 == 0:
+                # Expired keys that are never read again would otherwise stay forever
+                now = time.time()
+                for expired in [k for k, at in self._expiry.items() if at <= now]:
+                    self._values.pop(expired, None)
+                    del self._expiry[expired]
+            self._values[key] = value
+            if ex:
+                self._expiry[key] = time.time() + ex
+            else:
+                self._expiry.pop(key, None)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            removed = 0
+            for key in keys:
+                removed += self._values.pop(key, None) is not None
+                self._expiry.pop(key, None)
+            return removed
+
+def create_shared_state(backend: Optional[str] = None) -> SharedState:
+    """Build the shared state backend selected by SHARED_STATE_BACKEND"""
+    backend = backend or settings.shared_state_backend
+    if backend == "sqlite":
+        return SQLiteSharedState()
+    if backend == "redis":
+        return RedisSharedState()
+    if backend == "memory":
+        return RedisSharedState(client=InMemoryRedis())
+    raise ValueError(f"Unknown shared state backend: {backend}")
+
+# Global shared state instance
+shared_state = create_shared_state()
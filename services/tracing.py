@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set
+from config.settings import settings
+
+class Span:
+    """One timed step of a trace"""
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "thread", "lane", "attrs")
+
+    def __init__(
+        self,
+        span_id: int,
+        parent_id: Optional[int],
+        name: str,
+        start: float,
+        thread: int,
+        lane: int,
+        attrs: Dict[str, Any]
+    ):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.thread = thread
+        self.lane = lane
+        self.attrs = attrs
+
+def _lane_key() -> Any:
+    """Identify the caller: its asyncio task on the event loop, else its thread"""
+    try:
+        return id(asyncio.current_task())
+    except RuntimeError:
+        return threading.get_ident()
+
+class Trace:
+    """Spans recorded for one request, plus an optional stack-sample profile"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        # Threads that ran any part of the request; the profiler samples these
+        self.threads: Set[int] = {threading.get_ident()}
+        self.profile: Optional[Counter] = None
+        self.exported_to: Optional[str] = None
+        # Chrome trace rows; overlapping spans must sit on different rows
+        self._lanes: Dict[Any, int] = {_lane_key(): 0}
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def _lane(self) -> int:
+        with self._lock:
+            return self._lanes.setdefault(_lane_key(), len(self._lanes))
+
+    def open_span(
+        self,
+        name: str,
+        parent_id: Optional[int],
+        attrs: Dict[str, Any],
+        start: Optional[float] = None
+    ) -> Span:
+        thread = threading.get_ident()
+        self.threads.add(thread)
+        lane = self._lane()
+        start = start if start is not None else time.perf_counter()
+        with self._lock:
+            span = Span(len(self.spans) + 1, parent_id, name, start, thread, lane, attrs)
+            self.spans.append(span)
+        return span
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """Total seconds and count per span name"""
+        totals: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            if span.end is None:
+                continue
+            entry = totals.setdefault(span.name, {"seconds": 0.0, "count": 0})
+            entry["seconds"] += span.end - span.start
+            entry["count"] += 1
+        return totals
+
+    def summary(self, top_stacks: int = 10) -> Dict[str, Any]:
+        summary = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration": self.duration,
+            "spans": self.breakdown(),
+            "exported_to": self.exported_to,
+        }
+        if self.profile:
+            summary["profile"] = {
+                "samples": sum(self.profile.values()),
+                "top_stacks": [
+                    {"stack": stack, "samples": count} for stack, count in self.profile.most_common(top_stacks)
+                ]
+            }
+        return summary
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """The trace in Chrome trace-event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"{self.name} {self.trace_id}"}}
+        ]
+        lanes = sorted({span.lane for span in self.spans} | {0})
+        events.extend(
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": lane, "args": {"name": "request" if lane == 0 else f"lane {lane}"}}
+            for lane in lanes
+        )
+        events.append({
+            "name": self.name, "ph": "X", "pid": pid, "tid": 0,
+            "ts": 0, "dur": self.duration * 1e6, "args": self.attrs
+        })
+        for span in self.spans:
+            end = span.end if span.end is not None else time.perf_counter()
+            events.append({
+                "name": span.name, "ph": "X", "pid": pid, "tid": span.lane,
+                "ts": (span.start - self.start) * 1e6, "dur": (end - span.start) * 1e6,
+                "args": dict(span.attrs, thread=span.thread)
+            })
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "started_at": self.started_at, "duration": self.duration}
+        }
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+class _SpanContext:
+    """Times a block as a span of the current trace; a no-op when nothing is traced"""
+
+    __slots__ = ("name", "attrs", "trace", "span", "token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+        self.span = None
+        self.token = None
+
+    def __enter__(self) -> "_SpanContext":
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.span = self.trace.open_span(self.name, current_span.get(), self.attrs)
+            self.token = current_span.set(self.span.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.span is None:
+            return
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        current_span.reset(self.token)
+
+    def set(self, **attrs: Any) -> None:
+        """Attach attributes discovered inside the block"""
+        if self.span is not None:
+            self.span.attrs.update(attrs)
+
+def span(name: str, **attrs: Any) -> _SpanContext:
+    """Time a block (sync or async code) as a child of the current span"""
+    return _SpanContext(name, attrs)
+
+def add_span(name: str, start: float, end: float, **attrs: Any) -> None:
+    """Record a span measured elsewhere, with perf_counter() start and end times"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.open_span(name, current_span.get(), attrs, start=start).end = end
+
+def bind_trace(trace: Optional[Trace]) -> None:
+    """Make trace current in this context, e.g. in a response task started by the handler"""
+    if trace is not None:
+        current_trace.set(trace)
+        current_span.set(None)
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes to the current trace"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+def _fold(frame, max_depth: int = 64) -> str:
+    """A thread's stack in collapsed flame-graph format, root first"""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Samples the stacks of threads working on profiled traces
+
+    A statistical profiler: cheap enough to run on live requests and, unlike
+    cProfile, it sees the worker threads a request hands work to. The event
+    loop thread is shared, so its samples include concurrent requests.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active: Set[Trace] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def attach(self, trace: Trace) -> None:
+        trace.profile = Counter()
+        with self._lock:
+            self._active.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+                self._thread.start()
+
+    def detach(self, trace: Trace) -> None:
+        with self._lock:
+            self._active.discard(trace)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            # Held while sampling so a detached trace's profile is final
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for trace in self._active:
+                    for thread in list(trace.threads):
+                        frame = frames.get(thread)
+                        if frame is None or thread == own:
+                            continue
+                        if frame.f_code.co_filename.endswith("selectors.py"):
+                            # Event loop waiting for I/O: awaiting, not computing
+                            trace.profile["(idle)"] += 1
+                        else:
+                            trace.profile[_fold(frame)] += 1
+
+class TraceRecorder:
+    """Keeps recent traces in memory and exports slow ones to disk"""
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        slow_seconds: Optional[float] = None,
+        profile_rate: Optional[float] = None,
+        trace_dir: Optional[Path] = None,
+        buffer_size: Optional[int] = None
+    ):
+        self.enabled = enabled if enabled is not None else settings.tracing_enabled
+        self.slow_seconds = slow_seconds if slow_seconds is not None else settings.trace_slow_seconds
+        self.profile_rate = profile_rate if profile_rate is not None else settings.trace_profile_rate
+        self.trace_dir = Path(trace_dir or settings.trace_dir)
+        self.sampler = StackSampler(settings.trace_profile_interval)
+        self._recent: Deque[Trace] = deque(maxlen=buffer_size or settings.trace_buffer_size)
+
+    def start(self, name: str, **attrs: Any) -> Optional[Trace]:
+        """Begin tracing the current request; returns None when tracing is off"""
+        if not self.enabled:
+            return None
+        trace = Trace(name, attrs)
+        bind_trace(trace)
+        # Whether a request will be slow is only known at the end, so a
+        # sampled share is profiled and the profile kept only if it was slow
+        if self.profile_rate and random.random() < self.profile_rate:
+            self.sampler.attach(trace)
+        return trace
+
+    def finish(self, trace: Optional[Trace], **attrs: Any) -> None:
+        """End a trace, keep it for /admin/traces and export it if it was slow"""
+        if trace is None or trace.end is not None:
+            return
+        trace.end = time.perf_counter()
+        trace.attrs.update(attrs)
+        if trace.profile is not None:
+            self.sampler.detach(trace)
+        if trace.duration >= self.slow_seconds:
+            try:
+                self.export(trace)
+            except Exception as e:
+                print(f"Failed to export trace {trace.trace_id}: {e}")
+        else:
+            trace.profile = None
+        self._recent.append(trace)
+
+    def export(self, trace: Trace) -> Path:
+        """Write a trace as Chrome trace JSON, with its profile as collapsed stacks"""
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{datetime.fromtimestamp(trace.started_at).strftime('%Y%m%d-%H%M%S')}_{trace.name}_{trace.trace_id}"
+        path = self.trace_dir / f"{stem}.json"
+        with open(path, "w") as f:
+            json.dump(trace.to_chrome(), f)
+        if trace.profile:
+            # Feed to flamegraph.pl or speedscope
+            with open(self.trace_dir / f"{stem}.folded", "w") as f:
+                for stack, count in trace.profile.most_common():
+                    f.write(f"{stack} {count}\n")
+        trace.exported_to = str(path)
+        return path
+
+    def slowest(self, n: int = 10) -> List[Trace]:
+        """The n slowest traces still held in memory by this worker"""
+        return sorted(self._recent, key=lambda trace: trace.duration, reverse=True)[:n]
+
+# Global trace recorder
+tracer = TraceRecorder()
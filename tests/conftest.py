@@ -0,0 +1,12 @@
+import os
+import sys
+from pathlib import Path
+
+# Keep the module-level shared state out of the working tree's logs/
+os.environ.setdefault("SHARED_STATE_BACKEND", "memory")
+# services.fal_service builds its global instance at import
+os.environ.setdefault("FAL_API_KEY", "test-key")
+
+ROOT = Path(__file__).resolve().parent.parent
+# The app imports modules from the repo root; the installer lives in scripts/
+sys.path[:0] = [str(ROOT), str(ROOT / "scripts")]
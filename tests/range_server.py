@@ -0,0 +1,65 @@
+"""
+Static file server that honours single "bytes=N-" Range requests
+
+http.server's SimpleHTTPRequestHandler ignores Range, so it cannot exercise
+resumed downloads. Serve a directory of artifacts for install_models.py:
+
+    python tests/range_server.py 8000 /path/to/artifacts
+"""
+
+import os
+import re
+import sys
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-$")
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler plus 206/416 responses for open-ended ranges"""
+
+    def send_head(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        return f
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(directory, port=0):
+    """Serve directory on localhost in a background thread; returns the server"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(RangeRequestHandler, directory=str(directory)))
+    # Range header of every request, in order, for tests to inspect
+    server.ranges = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    server = start_server(sys.argv[2] if len(sys.argv) > 2 else ".", port)
+    print(f"Serving on http://127.0.0.1:{port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
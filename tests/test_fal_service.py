@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from services.fal_service import FalAIService
+from services.fal_stub import FalStub
+from services.shared_state import InMemoryRedis, RedisSharedState
+
+@pytest.fixture
+def face(tmp_path):
+    path = tmp_path / "face.jpg"
+    Image.new("RGB", (64, 64), color=(200, 150, 100)).save(path)
+    return str(path)
+
+@pytest.fixture
+def state():
+    return RedisSharedState(client=InMemoryRedis())
+
+def service_for(stub, state):
+    return FalAIService(transport=stub.transport, state=state)
+
+def generate(service, face, **kwargs):
+    return asyncio.run(service.generate_story_images(face, "a lighthouse", num_images=2, **kwargs))
+
+def uploads(stub):
+    return stub.requests.count("POST /storage/upload/initiate")
+
+def test_upload_is_reused_by_url(face, state):
+    stub = FalStub()
+    service = service_for(stub, state)
+
+    first = generate(service, face)
+    second = generate(service, face)
+
+    assert first["success"] and second["success"]
+    assert uploads(stub) == 1
+    assert first["images"][0] in stub.files
+
+def test_other_workers_reuse_the_shared_upload(face, state):
+    stub = FalStub()
+    generate(service_for(stub, state), face)
+
+    result = generate(service_for(stub, state), face)
+
+    assert result["success"]
+    assert uploads(stub) == 1
+
+def test_expired_upload_is_replaced(face, state):
+    stub = FalStub()
+    generate(service_for(stub, state), face)
+    stub.files.clear()
+
+    # A fresh worker finds the dead URL in the shared cache
+    service = service_for(stub, state)
+    result = generate(service, face)
+
+    assert result["success"]
+    assert uploads(stub) == 2
+    assert stub.requests.count("POST /fal-ai/flux/schnell") == 3
+    digest = next(iter(service._uploaded))
+    assert result["images"][0] in stub.files
+    assert state.cache_get(f"fal_upload:{digest}") == result["images"][0]
+
+def test_unrelated_rejection_keeps_the_upload(face, state):
+    stub = FalStub()
+    service = service_for(stub, state)
+    generate(service, face)
+
+    result = generate(service, face, width=4096)
+
+    assert not result["success"]
+    assert "422" in result["error"]
+    assert uploads(stub) == 1
+    assert stub.requests.count("POST /fal-ai/flux/schnell") == 2
+    digest = next(iter(service._uploaded))
+    assert state.cache_get(f"fal_upload:{digest}") in stub.files
+
+def test_face_swap_retries_expired_references(face, tmp_path, state):
+    target = tmp_path / "target.jpg"
+    Image.new("RGB", (64, 64), color=(10, 20, 30)).save(target)
+    stub = FalStub()
+    service = service_for(stub, state)
+    assert asyncio.run(service.generate_with_face_swap(face, str(target)))["success"]
+    stub.files.clear()
+
+    result = asyncio.run(service.generate_with_face_swap(face, str(target)))
+
+    assert result["success"]
+    assert uploads(stub) == 4
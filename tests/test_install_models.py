@@ -0,0 +1,113 @@
+import hashlib
+import os
+import urllib.error
+
+import pytest
+
+import install_models
+from range_server import start_server
+
+BODY = os.urandom(256 * 1024)
+DIGEST = hashlib.sha256(BODY).hexdigest()
+
+@pytest.fixture
+def server(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "model.bin").write_bytes(BODY)
+    server = start_server(served)
+    yield server
+    server.shutdown()
+
+def url_of(server, name="model.bin"):
+    return f"http://127.0.0.1:{server.server_address[1]}/{name}"
+
+def artifact(server, sha256=DIGEST, size=len(BODY)):
+    return {
+        "name": "model.bin",
+        "url": url_of(server),
+        "destination": "checkpoints/model.bin",
+        "sha256": sha256,
+        "size": size,
+    }
+
+def test_download_resumes_from_partial_file(server, tmp_path):
+    destination = tmp_path / "model.bin"
+    (tmp_path / "model.bin.part").write_bytes(BODY[:1000])
+
+    install_models.download_file(url_of(server), destination, len(BODY))
+
+    assert destination.read_bytes() == BODY
+    assert server.ranges == ["bytes=1000-"]
+
+def test_416_with_complete_partial_file_is_accepted(server, tmp_path):
+    destination = tmp_path / "model.bin"
+    (tmp_path / "model.bin.part").write_bytes(BODY)
+
+    install_models.download_file(url_of(server), destination, len(BODY))
+
+    assert destination.read_bytes() == BODY
+    assert server.ranges == [f"bytes={len(BODY)}-"]
+
+def test_416_with_oversized_partial_file_restarts(server, tmp_path):
+    destination = tmp_path / "model.bin"
+    (tmp_path / "model.bin.part").write_bytes(BODY + b"garbage")
+
+    install_models.download_file(url_of(server), destination, len(BODY))
+
+    assert destination.read_bytes() == BODY
+    assert server.ranges == [f"bytes={len(BODY) + 7}-", None]
+
+def test_missing_file_is_not_retried(server, tmp_path):
+    with pytest.raises(urllib.error.HTTPError):
+        install_models.download_file(url_of(server, "absent.bin"), tmp_path / "absent.bin")
+    assert len(server.ranges) == 1
+
+def test_fetch_installs_and_reuses_cache(server, tmp_path):
+    cache_dir = tmp_path / "cache"
+
+    install_models.fetch_artifact(artifact(server), cache_dir, root=tmp_path)
+    (tmp_path / "checkpoints" / "model.bin").unlink()
+    install_models.fetch_artifact(artifact(server), cache_dir, root=tmp_path)
+
+    assert (tmp_path / "checkpoints" / "model.bin").read_bytes() == BODY
+    assert (cache_dir / "sha256" / DIGEST).exists()
+    assert len(server.ranges) == 1
+
+def test_checksum_mismatch_is_rejected(server, tmp_path):
+    cache_dir = tmp_path / "cache"
+    wrong = "0" * 64
+
+    with pytest.raises(install_models.ChecksumError):
+        install_models.fetch_artifact(artifact(server, sha256=wrong), cache_dir, root=tmp_path)
+
+    assert not (cache_dir / "sha256" / wrong).exists()
+    assert not (tmp_path / "checkpoints" / "model.bin").exists()
+
+def test_verify_install(server, tmp_path):
+    manifest = tmp_path / "manifest.json"
+    entry = artifact(server)
+    unpinned = dict(artifact(server, sha256=None, size=None), name="other.bin", destination="checkpoints/other.bin")
+    manifest.write_text(install_models.json.dumps({"artifacts": [entry, unpinned]}))
+    checkpoints = tmp_path / "checkpoints"
+    checkpoints.mkdir()
+
+    assert not install_models.verify_install(manifest, root=tmp_path)
+
+    (checkpoints / "model.bin").write_bytes(BODY)
+    (checkpoints / "other.bin").write_bytes(b"anything")
+    assert install_models.verify_install(manifest, root=tmp_path)
+
+    (checkpoints / "model.bin").write_bytes(BODY[:-1] + b"x")
+    assert not install_models.verify_install(manifest, root=tmp_path)
+
+def test_concurrent_fetches_share_one_download(server, tmp_path):
+    cache_dir = tmp_path / "cache"
+    roots = [tmp_path / "a", tmp_path / "b", tmp_path / "c"]
+
+    with install_models.ThreadPoolExecutor(max_workers=len(roots)) as executor:
+        list(executor.map(lambda root: install_models.fetch_artifact(artifact(server), cache_dir, root=root), roots))
+
+    for root in roots:
+        assert (root / "checkpoints" / "model.bin").read_bytes() == BODY
+    assert len(server.ranges) == 1
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from services import shared_state as shared_state_module
+from services.shared_state import InMemoryRedis, RedisSharedState, SQLiteSharedState
+
+@pytest.fixture(params=["sqlite", "memory"])
+def state(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteSharedState(tmp_path / "state.db", record_ttl=60)
+    return RedisSharedState(client=InMemoryRedis(), record_ttl=60)
+
+def test_counters(state):
+    assert state.incr("images") == 1
+    assert state.incr("images", 4) == 5
+    state.init_counter("images", 100)
+    state.init_counter("sessions", 7)
+    assert state.counters() == {"images": 5, "sessions": 7}
+
+def test_incr_is_atomic_across_threads(state):
+    def bump():
+        for _ in range(50):
+            state.incr("hits")
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state.counters()["hits"] == 200
+
+def test_cache_set_get_delete(state):
+    assert state.cache_get("key") is None
+    state.cache_set("key", "value")
+    assert state.cache_get("key") == "value"
+    state.cache_set("key", "other")
+    assert state.cache_get("key") == "other"
+    state.cache_delete("key")
+    assert state.cache_get("key") is None
+
+def test_cache_ttl(state, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now)
+    state.cache_set("short", "value", ttl=10)
+    state.cache_set("forever", "value")
+
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now + 11)
+    assert state.cache_get("short") is None
+    assert state.cache_get("forever") == "value"
+
+def test_cache_add_only_once(state, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now)
+    assert state.cache_add("lease", "a", ttl=10)
+    assert not state.cache_add("lease", "b", ttl=10)
+    assert state.cache_get("lease") == "a"
+
+    # An expired entry can be claimed again
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now + 11)
+    assert state.cache_add("lease", "b", ttl=10)
+    assert state.cache_get("lease") == "b"
+
+def test_session_records(state):
+    assert state.get_session("s1") is None
+    state.put_session("s1", {"status": "started", "num_images": 4})
+    state.put_session("s1", {"status": "completed", "num_images": 4})
+    assert state.get_session("s1") == {"status": "completed", "num_images": 4}
+
+def test_sqlite_records_expire_and_are_pruned(tmp_path, monkeypatch):
+    state = SQLiteSharedState(tmp_path / "state.db", record_ttl=60)
+    now = time.time()
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now)
+    state.put_session("old", {"status": "started"})
+    state.cache_set("stale", "value", ttl=1)
+
+    monkeypatch.setattr(shared_state_module.time, "time", lambda: now + 61)
+    assert state.get_session("old") is None
+
+    state.prune()
+    conn = state._conn()
+    assert conn.execute("SELECT COUNT(*) FROM records").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    first = SQLiteSharedState(tmp_path / "state.db")
+    second = SQLiteSharedState(tmp_path / "state.db")
+    first.incr("images", 3)
+    first.put_session("s1", {"status": "completed"})
+    first.cache_set("key", "value")
+    assert second.counters() == {"images": 3}
+    assert second.get_session("s1") == {"status": "completed"}
+    assert second.cache_get("key") == "value"
+
+def test_redis_records_use_native_expiry():
+    client = InMemoryRedis()
+    state = RedisSharedState(client=client, prefix="test:", record_ttl=60)
+    state.put_session("s1", {"status": "started"})
+    assert client._expiry["test:session:s1"] == pytest.approx(time.time() + 60, abs=5)